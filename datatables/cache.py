@@ -0,0 +1,123 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+VERSION_KEY = "datatables:version:{}"
+
+
+def get_model_version(model):
+    """Return the current version of a model's table.
+
+    The version is the time of the last save or delete of the model seen
+    through signals.
+    """
+    key = VERSION_KEY.format(model._meta.label_lower)
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_model_version(model):
+    key = VERSION_KEY.format(model._meta.label_lower)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_model_version(sender, **kwargs):
+    cache.set(VERSION_KEY.format(sender._meta.label_lower), time.time(), None)
+
+
+def watch_model(model):
+    """Invalidate everything cached for model when it is saved or deleted."""
+    uid = f"datatables:{model._meta.label_lower}"
+    post_save.connect(bump_model_version, sender=model, dispatch_uid=uid)
+    post_delete.connect(bump_model_version, sender=model, dispatch_uid=uid)
+
+
+class ModelCache:
+    """Cache a value computed from the rows of a model.
+
+    Entries are stored together with the version of the model they were
+    computed at, a change to the model makes them stale. If serve_stale is
+    set a stale entry is kept after it expires and returned to every caller
+    except the one that gets to recompute it.
+    """
+
+    lock_timeout = 60
+
+    def __init__(self, key, model, timeout, serve_stale=False):
+        self.key = key
+        self.model = model
+        self.timeout = timeout
+        self.serve_stale = serve_stale
+
+    def get_or_set(self, compute):
+        version = get_model_version(self.model)
+        entry = cache.get(self.key)
+        if entry is not None:
+            value, expires, entry_version = entry
+            if entry_version == version and expires > time.time():
+                return value
+            if self.serve_stale and not cache.add(
+                f"{self.key}:lock", True, self.lock_timeout
+            ):
+                return value
+
+        value = compute()
+        cache.set(
+            self.key,
+            (value, time.time() + self.timeout, version),
+            None if self.serve_stale else self.timeout,
+        )
+        if self.serve_stale:
+            cache.delete(f"{self.key}:lock")
+        return value
+
+    async def aget_or_set(self, compute):
+        """Like get_or_set() but compute is awaited."""
+        version = await aget_model_version(self.model)
+        entry = await cache.aget(self.key)
+        if entry is not None:
+            value, expires, entry_version = entry
+            if entry_version == version and expires > time.time():
+                return value
+            if self.serve_stale and not await cache.aadd(
+                f"{self.key}:lock", True, self.lock_timeout
+            ):
+                return value
+
+        value = await compute()
+        await cache.aset(
+            self.key,
+            (value, time.time() + self.timeout, version),
+            None if self.serve_stale else self.timeout,
+        )
+        if self.serve_stale:
+            await cache.adelete(f"{self.key}:lock")
+        return value
+
+
+class QueryCache(ModelCache):
+    """Cache a value computed from a queryset, keyed by its SQL."""
+
+    kind = "query"
+
+    def __init__(self, prefix, queryset, timeout, serve_stale=False):
+        sql = str(queryset.query).encode()
+        key = f"datatables:{self.kind}:{prefix}:{hashlib.md5(sql).hexdigest()}"
+        super().__init__(key, queryset.model, timeout, serve_stale)
+
+
+class CountCache(QueryCache):
+    """Cache the result of a count query for a model."""
+
+    kind = "count"
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections
+from django.utils import timezone, translation
+
+
+class QueryExecutor:
+    """Run the independent queries of a request on a bounded thread pool.
+
+    Each thread has its own database connections, which are closed after
+    every query unless CONN_MAX_AGE keeps them open. Queries run with the
+    time zone and language that are active where they are submitted.
+    """
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.executor = None
+
+    def submit(self, func, *args):
+        """Return a Future for the result of func(*args)."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="datatables-query"
+            )
+        return self.executor.submit(
+            self.run,
+            timezone.get_current_timezone(),
+            translation.get_language(),
+            func,
+            *args,
+        )
+
+    def run(self, tz, language, func, *args):
+        close_old_connections()
+        try:
+            with timezone.override(tz), translation.override(language):
+                return func(*args)
+        finally:
+            close_old_connections()
+
+
+default_executor = QueryExecutor()
+
+
+def can_run_concurrently(using):
+    """Return True if queries on the database using can run concurrently.
+
+    They run on other connections and have to see the same data.
+    """
+    connection = connections[using]
+    if connection.in_atomic_block:
+        # Other connections can't see the changes of an open transaction
+        return False
+    if connection.vendor == "sqlite" and connection.is_in_memory_db():
+        # Each connection has its own in-memory database
+        return False
+    return True
@@ -0,0 +1,114 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+class ExactCount:
+    """Count rows with COUNT(*).
+
+    Strategies that override count() should override acount() as well.
+    """
+
+    def count(self, qs):
+        """Return a tuple of (count, approximate)."""
+        return qs.count(), False
+
+    async def acount(self, qs):
+        return await qs.acount(), False
+
+
+class ReltuplesCount(ExactCount):
+    """Use the planner's row estimate from pg_class.reltuples for whole tables.
+
+    The estimate is only as fresh as the last VACUUM/ANALYZE. Filtered
+    querysets and other databases are counted exactly.
+    """
+
+    def is_unfiltered(self, qs):
+        query = qs.query
+        return (
+            connections[qs.db].vendor == "postgresql"
+            and not query.where
+            and not query.combinator
+            and query.group_by is None
+            and query.low_mark == 0
+            and query.high_mark is None
+            and len(query.alias_map) <= 1
+        )
+
+    def reltuples(self, qs):
+        connection = connections[qs.db]
+        table = connection.ops.quote_name(qs.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 (or 0 on older versions) before the table is analyzed
+        if row is None or row[0] <= 0:
+            return None
+        return row[0]
+
+    def estimate(self, qs):
+        if self.is_unfiltered(qs):
+            return self.reltuples(qs)
+        return None
+
+    def count(self, qs):
+        estimate = self.estimate(qs)
+        if estimate is None:
+            return super().count(qs)
+        return estimate, True
+
+    async def acount(self, qs):
+        # Estimates are read with raw cursors, which are only synchronous
+        return await sync_to_async(self.count)(qs)
+
+
+class EstimatedCount(ReltuplesCount):
+    """Like ReltuplesCount but estimate filtered querysets as well.
+
+    Filtered querysets use the row estimate of the top node of the query plan
+    from EXPLAIN.
+    """
+
+    def explain(self, qs):
+        sql, params = qs.query.sql_with_params()
+        with connections[qs.db].cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def estimate(self, qs):
+        if self.is_unfiltered(qs):
+            return self.reltuples(qs)
+        if connections[qs.db].vendor == "postgresql":
+            return self.explain(qs)
+        return None
+
+
+class ThresholdCount(ExactCount):
+    """Count exactly up to limit rows.
+
+    Larger results are estimated with the estimate strategy.
+    """
+
+    def __init__(self, limit=10000, estimate=None):
+        self.limit = limit
+        self.estimate = estimate or EstimatedCount()
+
+    def count(self, qs):
+        count = qs[: self.limit + 1].count()
+        if count <= self.limit:
+            return count, False
+        return self.estimate.count(qs)
+
+    async def acount(self, qs):
+        count = await qs[: self.limit + 1].acount()
+        if count <= self.limit:
+            return count, False
+        return await self.estimate.acount(qs)
@@ -1,19 +1,43 @@
+import asyncio
 import json
+import operator
+import warnings
+from contextlib import nullcontext
 from datetime import datetime
+from functools import lru_cache, partial
 
+from asgiref.sync import sync_to_async
 from django.contrib.admin.utils import get_fields_from_path
-from django.core.paginator import Paginator
+from django.core.exceptions import (
+    EmptyResultSet,
+    FieldDoesNotExist,
+    FieldError,
+    ValidationError,
+)
 from django.db import models
 from django.template.loader import render_to_string
+from django.utils.encoding import force_str, iri_to_uri
+from django.utils.functional import cached_property
+from django.utils.hashable import make_hashable
 from django.utils.timezone import get_current_timezone
 
+from .cache import CountCache, QueryCache
+from .concurrency import can_run_concurrently
+from .counts import ExactCount
 from .datatable_filters import DateTimeFieldListFilter, FieldListFilter
+from .delta import decode_since, encode_since, get_page_hash
+from .pagination import KeysetPaginator
+from .search import IContainsSearch
 from .utils import (
     format_datetime,
     label_for_field,
 )
 
 
+async def alist(qs):
+    return [row async for row in qs]
+
+
 class Datatable:
     template = "datatables/_datatable.html"
     table_template = "datatables/table.html"
@@ -37,6 +61,22 @@ class Datatable:
         config={},
         paginate_by=25,
         show_columns=True,
+        keyset_pagination=False,
+        count_cache_timeout=None,
+        count_cache_serve_stale=False,
+        count_strategy=None,
+        countless_pagination=False,
+        select_related=None,
+        prefetch_related=None,
+        column_fields=None,
+        search_backend=None,
+        column_search=None,
+        filter_cache_timeout=None,
+        facets=False,
+        facet_cache_timeout=None,
+        change_tracking_field=None,
+        query_executor=None,
+        datetime_format=None,
     ):
         self.request = request
         self.model = model
@@ -44,11 +84,6 @@ class Datatable:
         self.columns = columns
         self._filters = filters
         self.filter_lookup = filter_lookup
-        self.lookup_opts = []
-        if model:
-            self.lookup_opts = [f.name for f in model._meta.get_fields()]
-
-        self.filter_specs = self.get_filters()
         self.ordering = ordering
         self.search_fields = search_fields
         self.table_search_fields = table_search_fields
@@ -57,6 +92,26 @@ class Datatable:
         self.update_interval = update_interval
         self.exportable = view.exportable
         self.paginate_by = paginate_by
+        self.keyset_pagination = keyset_pagination
+        self.count_cache_timeout = count_cache_timeout
+        self.count_cache_serve_stale = count_cache_serve_stale
+        self.count_strategy = count_strategy or ExactCount()
+        self.countless_pagination = countless_pagination
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+        self.column_fields = column_fields or {}
+        self.search_backend = search_backend or IContainsSearch()
+        self.column_search = column_search or {}
+        self.filter_cache_timeout = filter_cache_timeout
+        self.facets = facets
+        self.facet_cache_timeout = facet_cache_timeout
+        self.change_tracking_field = change_tracking_field
+        self.query_executor = query_executor
+        self.datetime_format = datetime_format
+        self.total_queryset = None
+        self.timing = None
+        self._accessors = {}
+        self._datetime_formatters = {}
 
     def __str__(self):
         return render_to_string(self.template, self.get_context())
@@ -90,77 +145,561 @@ class Datatable:
     def get_config(self):
         return json.dumps(self.config)
 
+    @cached_property
+    def lookup_opts(self):
+        if self.model:
+            return [f.name for f in self.model._meta.get_fields()]
+        return []
+
+    @cached_property
+    def filter_specs(self):
+        """Return the filters shown above the table.
+
+        Building them can query the database for choices so it's only done
+        when the table is rendered.
+        """
+        return self.get_filters()
+
     def get_filters(self):
-        self.filter_specs = {}
+        filter_specs = {}
         for list_filter, *settings in self._filters:
-            try:
-                settings = dict(settings)
-            except ValueError:
-                settings = {}
-
-            field_path = None
-            field, field_list_filter_class = list_filter, FieldListFilter.create
-            if not isinstance(field, models.Field):
-                # For annotated data you have to specify the type
-                if "field_type" in settings:
-                    # No path for annotated fields
-                    field_path = list_filter
-                    field = settings["field_type"]()
-                else:
-                    field_path = field
-                    field = get_fields_from_path(self.model, field_path)[-1]
-
-            spec = field_list_filter_class(
-                field,
-                self.model,
-                field_path=field_path,
-                **settings,
-            )
+            spec = self.get_filter_spec(list_filter, settings)
             if spec and spec.has_output():
-                self.filter_specs[list_filter] = spec
+                filter_specs[list_filter] = spec
 
-        return self.filter_specs.values()
+        return filter_specs.values()
+
+    def get_filter_spec(self, list_filter, settings):
+        try:
+            settings = dict(settings)
+        except ValueError:
+            settings = {}
+        view = type(self.view)
+        settings.setdefault("cache_timeout", self.filter_cache_timeout)
+        settings.setdefault("cache_prefix", f"{view.__module__}.{view.__qualname__}")
+
+        field_path = None
+        field, field_list_filter_class = list_filter, FieldListFilter.create
+        if not isinstance(field, models.Field):
+            # For annotated data you have to specify the type
+            if "field_type" in settings:
+                # No path for annotated fields
+                field_path = list_filter
+                field = settings["field_type"]()
+            else:
+                field_path = field
+                field = get_fields_from_path(self.model, field_path)[-1]
+
+        return field_list_filter_class(
+            field,
+            self.model,
+            field_path=field_path,
+            **settings,
+        )
+
+    def filter_choices(self, name, term):
+        """Return the choices of the typeahead filter name that match term.
+
+        None is returned if there is no such filter.
+        """
+        for list_filter, *settings in self._filters:
+            if list_filter != name:
+                continue
+            spec = self.get_filter_spec(list_filter, settings)
+            if not getattr(spec, "typeahead", None):
+                return None
+            return list(spec.choices(spec.search_choices(term)))
+        return None
 
     def serialize(self, qs):
+        page_size, offset = self.get_page_bounds()
+        if self.is_concurrent(qs):
+            futures = self.submit_queries(qs, page_size, offset)
+            return self.get_concurrent_result(
+                {key: future.result() for key, future in futures.items()}
+            )
+
+        counts = None
+        if not self.countless_pagination:
+            counts = self.call_timed("count_filtered", self.count_strategy.count, qs)
+        result = self.get_counts_result(counts)
+
+        if self.change_tracking_field:
+            result.update(self.serialize_delta(qs, page_size, offset))
+        else:
+            result.update(self.serialize_page(qs, page_size, offset))
+        if self.facets:
+            result["facets"] = self.call_timed("facets", self.get_facets)
+        return result
+
+    def timed(self, phase):
+        """Return a context manager that times phase if timing is enabled."""
+        if self.timing is None:
+            return nullcontext()
+        return self.timing.phase(phase)
+
+    def call_timed(self, phase, func, *args):
+        with self.timed(phase):
+            return func(*args)
+
+    def is_concurrent(self, qs):
+        return self.query_executor is not None and can_run_concurrently(qs.db)
+
+    def submit_queries(self, qs, page_size, offset):
+        """Submit the counts, the page and the facets to the query executor.
+
+        They are submitted at once, the total only if get_queryset() left it
+        to serialize(). Return a dict of their futures.
+        """
+        submit = self.query_executor.submit
+        futures = {}
+        if self.total_queryset is not None:
+            futures["total"] = submit(
+                self.call_timed, "count_total", self.get_total, self.total_queryset
+            )
+        if not self.countless_pagination:
+            futures["counts"] = submit(
+                self.call_timed, "count_filtered", self.count_strategy.count, qs
+            )
+        if self.change_tracking_field:
+            futures["page"] = submit(self.serialize_delta, qs, page_size, offset)
+        else:
+            futures["page"] = submit(self.serialize_page, qs, page_size, offset)
+        if self.facets:
+            futures["facets"] = submit(self.call_timed, "facets", self.get_facets)
+        return futures
+
+    def get_concurrent_result(self, results):
+        if "total" in results:
+            self.total, self.total_approximate = results["total"]
+        result = self.get_counts_result(results.get("counts"))
+        result.update(results["page"])
+        if "facets" in results:
+            result["facets"] = results["facets"]
+        return result
+
+    def get_page_bounds(self):
+        """Return a tuple of (page_size, offset) of the requested page."""
         page, page_size = self.parse_page_info()
-        pager = Paginator(qs, page_size)
+        return page_size, int((page - 1) * page_size)
+
+    def get_counts_result(self, counts):
+        """Return the record counts of a response, counts is None if countless."""
+        if counts is None:
+            # The client works out the paging from hasMore
+            return {"recordsTotal": -1, "recordsFiltered": -1}
+        filtered, filtered_approximate = counts
         return {
             "recordsTotal": self.total,
-            "recordsFiltered": pager.count,
-            "data": self.serialize_data(pager.page(page)),
+            "recordsFiltered": filtered,
+            "recordsTotalApproximate": self.total_approximate,
+            "recordsFilteredApproximate": filtered_approximate,
         }
 
-    def serialize_data(self, data):
-        result = []
-        for item in data:
-            obj = {}
-            columns = self.columns
-            for column in columns:
-                if isinstance(column, tuple):
-                    column = column[0]
+    def get_page(self, qs, page_size, offset):
+        """Return a tuple of (rows, has_more, cursors) for the page of qs."""
+        if self.keyset_pagination:
+            paginator = KeysetPaginator(qs, self.parse_ordering(), page_size)
+            rows, cursors = paginator.page(self.request.GET.get("cursor"), offset)
+            return rows, cursors["next"] is not None, cursors
+
+        # Fetch one extra row to tell if there is a next page
+        rows = list(qs[offset : offset + page_size + 1])
+        return rows[:page_size], len(rows) > page_size, None
+
+    def serialize_page(self, qs, page_size, offset):
+        qs, accessors = self.get_rows_queryset(qs, self.columns)
+        with self.timed("page"):
+            rows, has_more, cursors = self.get_page(qs, page_size, offset)
+        with self.timed("serialize"):
+            data = self.serialize_rows(rows, accessors)
+        result = {"hasMore": has_more, "data": data}
+        if cursors is not None:
+            result["cursor"] = cursors
+        return result
+
+    def serialize_delta(self, qs, page_size, offset):
+        """Serialize the page, or only its rows that changed since the token.
+
+        Only the changed rows are sent if the page still holds the same rows in
+        the same order as when the since token was made.
+
+        The rows and the version of each row in the change tracking field are
+        read first with a light query. Rows have their pk in DT_RowId so that
+        the client can find the rows to update.
+        """
+        with self.timed("page"):
+            keys, has_more, cursors = self.get_page(
+                qs.values_list("pk", self.change_tracking_field), page_size, offset
+            )
+        result, rows_qs = self.get_delta(qs, keys, has_more, cursors)
+        rows_qs, accessors = self.get_rows_queryset(rows_qs, self.columns)
+        with self.timed("page"):
+            rows = self.get_delta_rows(keys, list(rows_qs))
+        with self.timed("serialize"):
+            result["data"] = self.serialize_rows(rows, accessors)
+        self.set_row_ids(rows, result["data"])
+        return result
+
+    def get_delta(self, qs, keys, has_more, cursors):
+        """Return a tuple of (result, rows_qs) of the delta of the page.
+
+        rows_qs gives the rows of the page that have to be sent.
+        """
+        pks = [key[0] for key in keys]
+        versions = [key[1] for key in keys if key[1] is not None]
+        result = {
+            "hasMore": has_more,
+            "since": encode_since(pks, max(versions) if versions else None),
+        }
+        if cursors is not None:
+            result["cursor"] = cursors
+
+        since = self.get_since(pks)
+        if since is not None:
+            version = since["v"]
+            changed = [
+                key[0]
+                for key in keys
+                if key[1] is not None and (version is None or key[1] > version)
+            ]
+            rows_qs = qs.filter(pk__in=changed) if changed else qs.none()
+            result["delta"] = True
+        else:
+            rows_qs = qs.filter(pk__in=pks)
+            result["delta"] = False
+        return result, rows_qs
+
+    def get_since(self, pks):
+        """Return the payload of the request's since token.
+
+        Its version is converted to the change tracking field. None is
+        returned if the token wasn't made for the page of pks.
+        """
+        since = decode_since(self.request.GET.get("since", ""))
+        if since is None or since["p"] != get_page_hash(pks):
+            return None
+        if since["v"] is not None:
+            field = self.get_column_field(self.change_tracking_field)
+            try:
+                since["v"] = field.to_python(since["v"])
+            except (ValidationError, TypeError):
+                return None
+        return since
+
+    def get_delta_rows(self, keys, rows):
+        """Return rows in the order of the page's keys."""
+        rows = {self.get_row_pk(row): row for row in rows}
+        return [rows[key[0]] for key in keys if key[0] in rows]
+
+    def set_row_ids(self, rows, data):
+        for row, item in zip(rows, data, strict=True):
+            item["DT_RowId"] = self.get_row_pk(row)
+
+    def get_row_pk(self, row):
+        # values_list() rows start with the pk
+        return row[0] if isinstance(row, tuple) else row.pk
+
+    def get_rows_queryset(self, qs, columns, raw=False, typed=False):
+        """Return a tuple of (queryset, accessors) to read columns.
+
+        The queryset gives the rows needed for columns and the accessors read
+        the columns from a row. Rows are tuples from values_list() if no column
+        needs a model instance.
+        """
+        values_plan = self.get_values_plan(columns, qs, raw, typed)
+        if values_plan is None:
+            accessors = self.get_accessors(columns, raw, typed)
+            return self.apply_projection(qs, columns), accessors
+
+        lookups, accessors = values_plan
+        return qs.prefetch_related(None).values_list(*lookups), accessors
+
+    def get_values_plan(self, columns, qs, raw=False, typed=False):
+        """Return a tuple of (lookups, accessors) to read columns from values.
+
+        The rows of values_list(*lookups) are read without creating any model
+        instances. None is returned if a column needs a view method, a property
+        or a related object.
+        """
+        lookups = ["pk"]  # Keeps DISTINCT from merging rows with equal values
+
+        def index(lookup):
+            if lookup not in lookups:
+                lookups.append(lookup)
+            return lookups.index(lookup)
+
+        accessors = []
+        for column in columns:
+            if isinstance(column, tuple):
+                column = column[0]
+            if self.get_view_method(column):
+                return None
+
+            if column in qs.query.annotation_select:
+                formatter = self.get_formatter(None, raw, typed, column)
+                accessors.append(
+                    (column, self._compile_value_accessor(index(column), formatter))
+                )
+                continue
+
+            resolved = self._resolve_value_column(column)
+            if resolved is None:
+                return None
+            relations, choices, field = resolved
+            accessor = self._compile_value_accessor(
+                index(column),
+                self.get_formatter(field, raw, typed, column),
+                [index(r) for r in relations],
+                choices,
+            )
+            accessors.append((column, accessor))
+
+        return lookups, accessors
+
+    def _compile_value_accessor(self, index, formatter, relations=(), choices=None):
+        if not relations and choices is None:
+            return lambda row: formatter(row[index])
+
+        def accessor(row):
+            if any(row[i] is None for i in relations):
+                # Same as following a missing relation on an instance
+                return formatter("")
+            attr = row[index]
+            if choices is not None:
+                attr = force_str(
+                    choices.get(make_hashable(attr), attr), strings_only=True
+                )
+            return formatter(attr)
+
+        return accessor
+
+    def _resolve_value_column(self, column):
+        model = self.model
+        names = column.split("__")
+        relations = []
+        for i, name in enumerate(names):
+            try:
+                field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
 
-                obj[column] = self.get_column_value(item, column)
+            if i < len(names) - 1:
+                if not field.related_model or not (
+                    field.many_to_one or field.one_to_one
+                ):
+                    return None
+                relations.append("__".join(names[: i + 1]))
+                model = field.related_model
+                continue
 
-            result.append(obj)
+            if field.is_relation or not field.concrete:
+                return None
+            if field.choices:
+                return relations, dict(make_hashable(field.flatchoices)), field
+            if hasattr(model, f"get_{name}_display"):
+                return None
+            return relations, None, field
 
+    def serialize_data(self, data):
+        return self.serialize_rows(data, self.get_accessors(self.columns))
+
+    def serialize_rows(self, rows, accessors):
+        result = []
+        for row in rows:
+            result.append({column: accessor(row) for column, accessor in accessors})
+
+        if self.timing is not None:
+            self.timing.add_rows(len(result))
         return result
 
     def get_column_value(self, item, column, raw=False):
+        return self.get_accessor(column, raw)(item)
+
+    def get_accessors(self, columns, raw=False, typed=False):
+        """Return a list of (column name, accessor) for columns."""
+        accessors = []
+        for column in columns:
+            if isinstance(column, tuple):
+                column = column[0]
+            accessors.append((column, self.get_accessor(column, raw, typed)))
+        return accessors
+
+    def get_accessor(self, column, raw=False, typed=False):
+        """Return a function that takes a row and returns the value of column.
+
+        Each column is only inspected the first time its accessor is asked for.
+        Typed accessors return the value itself instead of a string.
+        """
         if isinstance(column, tuple):
             column = column[0]
-        if hasattr(self.view, column):
-            view_func = getattr(self.view, column)
-            attr = view_func(item)
+        key = (column, raw, typed)
+        if key not in self._accessors:
+            self._accessors[key] = self.compile_accessor(column, raw, typed)
+        return self._accessors[key]
+
+    def compile_accessor(self, column, raw=False, typed=False):
+        field = None
+        view_method = self.get_view_method(column)
+        if view_method:
+            getter = view_method
         elif "__" in column:
-            fields = column.split("__")
-            attr = item
-            for field in fields:
-                attr = self._get_attr(attr, field)
+            getters = [self._compile_attr_getter(name) for name in column.split("__")]
+
+            def getter(item):
+                for get in getters:
+                    item = get(item)
+                return item
+
+            field = self.get_column_field(column)
         else:
-            attr = self._get_attr(item, column)
+            getter = self._compile_attr_getter(column, self.model)
+            field = self.get_column_field(column)
+
+        formatter = self.get_formatter(field, raw, typed, column)
+        return lambda item: formatter(getter(item))
+
+    def _compile_attr_getter(self, name, model=None):
+        display = f"get_{name}_display"
+        if model is not None:
+            if hasattr(model, display):
+                return operator.methodcaller(display)
+            return lambda item: getattr(item, name, "")
 
+        def get(item):
+            get_display = getattr(item, display, None)
+            if get_display is not None:
+                return get_display()
+            return getattr(item, name, "")
+
+        return get
+
+    def get_view_method(self, column):
+        """Return the method of the view that renders column, or None."""
+        method = getattr(self.view, column, None)
+        return method if callable(method) else None
+
+    def get_column_field(self, column):
+        """Return the model field shown by column, or None."""
+        model = self.model
+        field = None
+        for name in column.split("__"):
+            if model is None:
+                return None
+            try:
+                field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            model = field.related_model
+        return field
+
+    def get_formatter(self, field, raw=False, typed=False, column=None):
+        """Return the function used to turn values of field into strings.
+
+        Only values that can be datetimes need the full format_value.
+        """
+        if typed:
+            text = isinstance(field, (models.CharField, models.TextField))
+            return partial(self.format_typed, text=text)
+        if field is None or isinstance(field, models.DateTimeField):
+            if self.datetime_format is None and not raw:
+                return partial(self.format_value, raw=raw)
+            return partial(
+                self.format_datetime_value,
+                format_datetime=self.get_datetime_formatter(column, raw),
+            )
+        return self._format_plain
+
+    @staticmethod
+    def _format_plain(attr):
+        return "-" if attr is None else str(attr)
+
+    @cached_property
+    def timezone(self):
+        return get_current_timezone()
+
+    def format_typed(self, attr, text=False):
         if isinstance(attr, datetime):
-            attr = attr.astimezone(get_current_timezone())
+            return attr.astimezone(self.timezone)
+        if not text and isinstance(attr, str) and attr == "":
+            # A missing relation on the way to a value that isn't text
+            return None
+        return attr
+
+    def get_column_settings(self, column):
+        """Return the settings dict of column, the third item of its tuple."""
+        for item in self.columns:
+            if isinstance(item, tuple) and item[0] == column and len(item) > 2:
+                return item[2]
+        return {}
+
+    def get_datetime_formatter(self, column=None, raw=False):
+        """Return the function that renders the datetimes of column.
+
+        Formatters are created once per request and remember what they
+        returned for each datetime, so repeated values are only formatted once.
+        """
+        datetime_format = "text" if raw else self.datetime_format
+        naturaltime = False
+        if datetime_format == "text" and not raw:
+            naturaltime = self.get_column_settings(column).get("naturaltime", False)
+        key = (datetime_format, naturaltime)
+        if key not in self._datetime_formatters:
+            formatter = self.compile_datetime_formatter(datetime_format, naturaltime)
+            self._datetime_formatters[key] = lru_cache(maxsize=4096)(formatter)
+        return self._datetime_formatters[key]
+
+    def compile_datetime_formatter(self, datetime_format, naturaltime=False):
+        """Return a function that formats a datetime in the request time zone.
+
+        The format is "text", "iso" or milliseconds since the "epoch".
+        """
+        tz = self.timezone
+        if datetime_format == "epoch":
+            return lambda value: round(value.timestamp() * 1000)
+        if datetime_format == "iso":
+            return lambda value: value.astimezone(tz).isoformat()
+        if datetime_format != "text":
+            raise ValueError(f"Unknown datetime format {datetime_format!r}")
+        if naturaltime:
+            return lambda value: format_datetime(value.astimezone(tz))
+        return lambda value: value.astimezone(tz).strftime("%Y-%m-%d %H:%M")
+
+    def format_datetime_value(self, attr, format_datetime):
+        if isinstance(attr, datetime):
+            return format_datetime(attr)
+        return "-" if attr is None else str(attr)
+
+    def get_datetime_columns(self):
+        """Return the columns the client renders datetimes in as JSON.
+
+        Their names are mapped to "relative" if they show the time since as
+        well, "local" otherwise.
+        """
+        if self.datetime_format not in ("iso", "epoch"):
+            return ""
+        annotations = self.view.get_queryset().query.annotations if self.model else {}
+        columns = {}
+        for item in self.columns:
+            column = item[0] if isinstance(item, tuple) else item
+            settings = self.get_column_settings(column)
+            if column in annotations:
+                try:
+                    field = annotations[column].output_field
+                except FieldError:
+                    field = None
+            elif self.get_view_method(column):
+                field = None
+            else:
+                field = self.get_column_field(column)
+            if settings.get("datetime", isinstance(field, models.DateTimeField)):
+                relative = settings.get("naturaltime", False)
+                columns[column] = "relative" if relative else "local"
+        return json.dumps(columns)
+
+    def format_value(self, attr, raw=False):
+        if isinstance(attr, datetime):
+            attr = attr.astimezone(self.timezone)
             if raw:
                 attr = f'{attr.strftime("%Y-%m-%d %H:%M")}'
             else:
@@ -171,33 +710,213 @@ class Datatable:
 
         return str(attr)
 
-    def _get_attr(self, item, column):
-        if hasattr(item, f"get_{column}_display"):
-            attr = getattr(item, f"get_{column}_display")()
-        elif hasattr(item, column):
-            attr = getattr(item, column)
-        else:
-            attr = ""
-
-        return attr
-
     def get_orderable_columns(self):
-        available = self.lookup_opts
+        available = list(self.lookup_opts)
         if self.model:
             available += list(self.view.get_queryset().query.annotation_select)
         return available
 
     def get_queryset(self):
         qs = self.view.get_queryset()
-        self.total = qs.count()
-        filters = self.parse_filters()
+        if not self.countless_pagination:
+            if self.is_concurrent(qs):
+                # Counted by serialize() together with the other queries, so
+                # that exports don't count the table for nothing
+                self.total_queryset = qs
+            else:
+                self.total, self.total_approximate = self.call_timed(
+                    "count_total", self.get_total, qs
+                )
+        return self.call_timed("filter", self.filter_queryset, qs)
 
-        filters &= self.parse_search()
-        qs = qs.filter(filters)
+    def filter_queryset(self, qs):
+        """Apply the filters, searches and ordering of the request to qs."""
+        filters = self.parse_filters()
+        qs = self.apply_search(qs.filter(filters))
+        qs = self.apply_column_search(qs)
         ordering = self.parse_ordering()
         qs = qs.order_by(*ordering)
+        select_related, prefetch_related = self.get_related_lookups()
+        if select_related:
+            qs = qs.select_related(*select_related)
+        if prefetch_related:
+            qs = qs.prefetch_related(*prefetch_related)
         return qs.distinct()
 
+    def get_facets(self):
+        """Return the number of rows matching each choice of the filters.
+
+        The counts are keyed by the filter's lookup and the choice's query
+        string. Each filter is counted under the search and every other filter
+        with one grouped query.
+        """
+        facets = {}
+        for spec, counts_qs in self.get_facet_querysets():
+            if not self.facet_cache_timeout:
+                rows = list(counts_qs)
+            else:
+                try:
+                    facet_cache = self.get_query_cache(
+                        QueryCache, counts_qs, self.facet_cache_timeout
+                    )
+                except EmptyResultSet:
+                    rows = []
+                else:
+                    rows = facet_cache.get_or_set(partial(list, counts_qs))
+            facets[spec.lookup_kwarg] = self.get_facet_counts(spec, rows)
+        return facets
+
+    def get_facet_querysets(self):
+        """Yield the filters that have facets with their counts queryset."""
+        qs = self.apply_column_search(self.apply_search(self.view.get_queryset()))
+        for list_filter, *settings in self._filters:
+            spec = self.get_filter_spec(list_filter, settings)
+            if spec is None:
+                continue
+            counts_qs = spec.get_facet_queryset(
+                qs.filter(self.parse_filters(exclude=[spec.lookup_kwarg]))
+            )
+            if counts_qs is not None:
+                yield spec, counts_qs
+
+    def get_facet_counts(self, spec, rows):
+        return {
+            iri_to_uri(query_string): count
+            for query_string, count in spec.get_facet_counts(rows).items()
+        }
+
+    def get_query_cache(self, cache_class, qs, timeout, serve_stale=False):
+        """Return a cache_class cache of qs for the view.
+
+        Raises EmptyResultSet if qs can't match any rows.
+        """
+        view = type(self.view)
+        return cache_class(
+            f"{view.__module__}.{view.__qualname__}", qs, timeout, serve_stale
+        )
+
+    def apply_projection(self, qs, columns):
+        """Restrict qs to the fields needed to show columns."""
+        fields = self.get_only_fields(columns, qs)
+        if fields:
+            qs = qs.only(*fields)
+        return qs
+
+    def get_only_fields(self, columns, qs):
+        """Return the fields to pass to only() to read columns.
+
+        None is returned if a column reads something other than fields. The
+        fields used by a view method or a property can be declared in
+        column_fields.
+        """
+        fields = []
+        related_objects = []
+        for column in columns:
+            if isinstance(column, tuple):
+                column = column[0]
+            if column in self.column_fields:
+                fields.extend(self.column_fields[column])
+                continue
+            if self.get_view_method(column):
+                return None
+            if column == "pk" or column in qs.query.annotation_select:
+                continue
+
+            model = self.model
+            path = []
+            for name in column.split("__"):
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+
+                path.append(name)
+                if not field.is_relation:
+                    fields.append("__".join(path))
+                    break
+                if field.many_to_many or field.one_to_many or not field.related_model:
+                    # Prefetched, only needs the pk that is always loaded
+                    break
+                if not field.concrete:
+                    return None
+                model = field.related_model
+            else:
+                related_objects.append("__".join(path))
+
+        # Related objects that are shown as a whole are loaded with all their
+        # fields, and every joined relation has to be loaded to not be deferred.
+        select_related, _ = self.get_related_lookups()
+        for lookup in select_related:
+            if not any(f == lookup or f.startswith(f"{lookup}__") for f in fields):
+                related_objects.append(lookup)
+        fields = [
+            f
+            for f in fields
+            if not any(f.startswith(f"{lookup}__") for lookup in related_objects)
+        ]
+        return list(dict.fromkeys(fields + related_objects))
+
+    def get_related_lookups(self):
+        """Return the lookups to pass to select_related() and prefetch_related().
+
+        They fetch the related objects needed by the columns. Lookups given by
+        the view are used as they are.
+        """
+        if self.select_related is not None and self.prefetch_related is not None:
+            return self.select_related, self.prefetch_related
+
+        select_related = []
+        prefetch_related = []
+        for column in self.columns:
+            if isinstance(column, tuple):
+                column = column[0]
+            if self.get_view_method(column):
+                continue
+
+            model = self.model
+            path = []
+            prefetch = False
+            for name in column.split("__"):
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    break
+                if not field.is_relation:
+                    break
+
+                path.append(name)
+                # Relations that can return several objects (or a generic
+                # foreign key) can't be joined, everything below them has to
+                # be prefetched as well.
+                if field.many_to_many or field.one_to_many or not field.related_model:
+                    prefetch = True
+                lookups = prefetch_related if prefetch else select_related
+                lookup = "__".join(path)
+                if lookup not in lookups:
+                    lookups.append(lookup)
+                if not field.related_model:
+                    break
+                model = field.related_model
+
+        if self.select_related is not None:
+            select_related = self.select_related
+        if self.prefetch_related is not None:
+            prefetch_related = self.prefetch_related
+        return select_related, prefetch_related
+
+    def get_total(self, qs):
+        """Return a tuple of (count, approximate) for the unfiltered queryset."""
+        if self.count_cache_timeout is None:
+            return self.count_strategy.count(qs)
+
+        try:
+            count_cache = self.get_query_cache(
+                CountCache, qs, self.count_cache_timeout, self.count_cache_serve_stale
+            )
+        except EmptyResultSet:
+            return 0, False
+        return count_cache.get_or_set(lambda: self.count_strategy.count(qs))
+
     def _create_search_query(self, fields, search):
         q = models.Q()
         for search_field in fields:
@@ -206,16 +925,75 @@ class Datatable:
         return q
 
     def parse_search(self):
+        """Return a Q of the search values.
+
+        Deprecated, only used by apply_search() if a subclass overrides it.
+        """
         search = self.request.GET.get("main_search")
         table_search = self.request.GET.get("search[value]")
         query = models.Q()
         if search:
             query &= self._create_search_query(self.search_fields, search)
         if table_search:
-            query &= self._create_search_query(self.search_fields, table_search)
+            fields = self.table_search_fields or self.search_fields
+            query &= self._create_search_query(fields, table_search)
         return query
 
-    def parse_filters(self):
+    def apply_search(self, qs):
+        if type(self).parse_search is not Datatable.parse_search:
+            warnings.warn(
+                "Overriding Datatable.parse_search() is deprecated, set a "
+                "search_backend or override apply_search() instead.",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            return qs.filter(self.parse_search())
+
+        search = self.request.GET.get("main_search")
+        table_search = self.request.GET.get("search[value]")
+        if search:
+            qs = self.search_backend.filter(qs, self.search_fields, search)
+        if table_search:
+            fields = self.table_search_fields or self.search_fields
+            qs = self.search_backend.filter(qs, fields, table_search)
+        return qs
+
+    def apply_column_search(self, qs):
+        """Filter qs by the search values of the columns in column_search."""
+        for i, column in enumerate(self.columns):
+            if isinstance(column, tuple):
+                column = column[0]
+            lookup = self.column_search.get(column)
+            value = self.request.GET.get(f"columns[{i}][search][value]")
+            if lookup is None or not value:
+                continue
+            try:
+                qs = qs.filter(self.get_column_search_query(column, lookup, value))
+            except ValidationError:
+                # The value can never match the field
+                return qs.none()
+        return qs
+
+    def get_column_search_query(self, column, lookup, value):
+        field = self.get_column_field(column)
+
+        def to_python(value):
+            return value if field is None else field.to_python(value)
+
+        if lookup == "range":
+            low, _, high = value.partition(",")
+            query = models.Q()
+            if low.strip():
+                query &= models.Q(**{f"{column}__gte": to_python(low.strip())})
+            if high.strip():
+                query &= models.Q(**{f"{column}__lte": to_python(high.strip())})
+            return query
+        if lookup in ("exact", "gt", "gte", "lt", "lte"):
+            value = to_python(value)
+        return models.Q(**{f"{column}__{lookup}": value})
+
+    def parse_filter_args(self):
+        """Return the lookups of the filters[] parameters with their values."""
         filters = [
             i.split("=")
             for i in self.request.GET.getlist("filters[]")
@@ -239,9 +1017,14 @@ class Datatable:
             else:
                 args[f] = a
 
+        return args
+
+    def parse_filters(self, exclude=()):
+        args = self.parse_filter_args()
         query = models.Q()
         for f in args:
-            query &= models.Q(**{f: args[f]})
+            if f not in exclude:
+                query &= models.Q(**{f: args[f]})
 
         for f in self.view.get_filters():
             query &= models.Q(**f)
@@ -258,7 +1041,7 @@ class Datatable:
         return (page + 1, page_size)
 
     def parse_ordering(self):
-        sort_cols = self.ordering
+        sort_cols = list(self.ordering)
         for i in range(0, len(self.columns)):
             sort_col = self.request.GET.get(f"order[{i}][column]")
             if sort_col is None:
@@ -297,3 +1080,128 @@ class Datatable:
             )
 
         return columns
+
+    def get_column_search_inputs(self):
+        """Return a (header, lookup) for each column, lookup is None if unsearchable."""
+        return [
+            (header, self.column_search.get(field))
+            for header, field, *_ in self.get_table_columns()
+        ]
+
+
+class AsyncDatatable(Datatable):
+    """Datatable that runs its queries with the async ORM.
+
+    The request is parsed and the rows are serialized by the same code as
+    Datatable, the sync methods keep working for the parts of the view that
+    aren't async.
+    """
+
+    async def aget_queryset(self):
+        qs = self.view.get_queryset()
+        if not self.countless_pagination:
+            if self.is_concurrent(qs):
+                self.total_queryset = qs
+            else:
+                with self.timed("count_total"):
+                    self.total, self.total_approximate = await self.aget_total(qs)
+        return self.call_timed("filter", self.filter_queryset, qs)
+
+    async def aget_total(self, qs):
+        if self.count_cache_timeout is None:
+            return await self.count_strategy.acount(qs)
+
+        try:
+            count_cache = self.get_query_cache(
+                CountCache, qs, self.count_cache_timeout, self.count_cache_serve_stale
+            )
+        except EmptyResultSet:
+            return 0, False
+        return await count_cache.aget_or_set(lambda: self.count_strategy.acount(qs))
+
+    async def aserialize(self, qs):
+        page_size, offset = self.get_page_bounds()
+        if self.is_concurrent(qs):
+            # The async ORM runs every query on the same thread, the query
+            # executor runs them on several.
+            futures = self.submit_queries(qs, page_size, offset)
+            return self.get_concurrent_result(
+                {
+                    key: await asyncio.wrap_future(future)
+                    for key, future in futures.items()
+                }
+            )
+
+        counts = None
+        if not self.countless_pagination:
+            with self.timed("count_filtered"):
+                counts = await self.count_strategy.acount(qs)
+        result = self.get_counts_result(counts)
+
+        if self.change_tracking_field:
+            result.update(await self.aserialize_delta(qs, page_size, offset))
+        else:
+            result.update(await self.aserialize_page(qs, page_size, offset))
+        if self.facets:
+            with self.timed("facets"):
+                result["facets"] = await self.aget_facets()
+        return result
+
+    async def aget_page(self, qs, page_size, offset):
+        if self.keyset_pagination:
+            paginator = KeysetPaginator(qs, self.parse_ordering(), page_size)
+            rows, cursors = await paginator.apage(
+                self.request.GET.get("cursor"), offset
+            )
+            return rows, cursors["next"] is not None, cursors
+
+        rows = await alist(qs[offset : offset + page_size + 1])
+        return rows[:page_size], len(rows) > page_size, None
+
+    async def aserialize_page(self, qs, page_size, offset):
+        qs, accessors = self.get_rows_queryset(qs, self.columns)
+        with self.timed("page"):
+            rows, has_more, cursors = await self.aget_page(qs, page_size, offset)
+        with self.timed("serialize"):
+            data = await self.aserialize_rows(rows, accessors)
+        result = {"hasMore": has_more, "data": data}
+        if cursors is not None:
+            result["cursor"] = cursors
+        return result
+
+    async def aserialize_delta(self, qs, page_size, offset):
+        with self.timed("page"):
+            keys, has_more, cursors = await self.aget_page(
+                qs.values_list("pk", self.change_tracking_field), page_size, offset
+            )
+        result, rows_qs = self.get_delta(qs, keys, has_more, cursors)
+        rows_qs, accessors = self.get_rows_queryset(rows_qs, self.columns)
+        with self.timed("page"):
+            rows = self.get_delta_rows(keys, await alist(rows_qs))
+        with self.timed("serialize"):
+            result["data"] = await self.aserialize_rows(rows, accessors)
+        self.set_row_ids(rows, result["data"])
+        return result
+
+    async def aserialize_rows(self, rows, accessors):
+        if rows and not isinstance(rows[0], tuple):
+            # View methods and properties of model instances may query
+            return await sync_to_async(self.serialize_rows)(rows, accessors)
+        return self.serialize_rows(rows, accessors)
+
+    async def aget_facets(self):
+        facets = {}
+        for spec, counts_qs in self.get_facet_querysets():
+            if not self.facet_cache_timeout:
+                rows = await alist(counts_qs)
+            else:
+                try:
+                    facet_cache = self.get_query_cache(
+                        QueryCache, counts_qs, self.facet_cache_timeout
+                    )
+                except EmptyResultSet:
+                    rows = []
+                else:
+                    rows = await facet_cache.aget_or_set(partial(alist, counts_qs))
+            facets[spec.lookup_kwarg] = self.get_facet_counts(spec, rows)
+        return facets
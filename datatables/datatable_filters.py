@@ -3,8 +3,13 @@ from urllib.parse import urlencode
 from django.contrib.admin.utils import get_model_from_relation
 from django.core.exceptions import ImproperlyConfigured
 from django.db import models
+from django.utils.functional import cached_property
+from django.utils.translation import get_language
 from django.utils.translation import gettext_lazy as _
 
+from .cache import ModelCache, watch_model
+from .search import IContainsSearch
+
 
 class ListFilter:
     title = None  # Human-readable title to appear in the right sidebar.
@@ -63,6 +68,32 @@ class FieldListFilter(ListFilter):
     def has_output(self):
         return True
 
+    def get_facet_queryset(self, qs):
+        """Return a queryset of (value, count) rows for each value of the filter.
+
+        The rows of qs are counted for each value, None is returned if the
+        filter has no facets.
+        """
+        return None
+
+    def get_facet_counts(self, rows):
+        """Return the counts of get_facet_queryset() keyed by query string."""
+        return {
+            urlencode({self.lookup_kwarg: self.facet_lookup(value)}): count
+            for value, count in rows
+            if value is not None
+        }
+
+    def facet_lookup(self, value):
+        return str(value)
+
+    def count_values(self, qs, field_path):
+        return (
+            qs.order_by()
+            .values_list(field_path)
+            .annotate(count=models.Count("pk", distinct=True))
+        )
+
     @classmethod
     def register(cls, test, list_filter_class, take_priority=False):
         if take_priority:
@@ -86,16 +117,31 @@ class FieldListFilter(ListFilter):
 
 
 class RelatedFieldListFilter(FieldListFilter):
+    """Filter on the objects of a relation.
+
+    Settings:
+    - cache_timeout: seconds to cache the choices for, they are also
+      invalidated when an object of the related model is saved or deleted.
+    - typeahead: fields of the related model to search, the choices are then
+      loaded on demand instead of being rendered with the filter.
+    """
+
+    typeahead_limit = 20
+
     def __init__(self, field, model, field_path, **settings):
         other_model = get_model_from_relation(field)
+        self.other_model = other_model
         self.lookup_kwarg = "%s__%s__in" % (field_path, field.target_field.name)
         self.lookup_kwarg_isnull = "%s__in" % field_path
         super().__init__(field, model, field_path)
+        self.cache_timeout = settings.get("cache_timeout")
+        self.cache_prefix = settings.get("cache_prefix", model._meta.label_lower)
+        self.typeahead = settings.get("typeahead")
 
         if settings.get("choices"):
             self.lookup_choices = settings.get("choices")
-        else:
-            self.lookup_choices = self.field_choices(field)
+        elif self.typeahead:
+            self.lookup_choices = []
 
         if settings.get("title"):
             self.title = settings.get("title")
@@ -105,7 +151,7 @@ class RelatedFieldListFilter(FieldListFilter):
             self.title = other_model._meta.verbose_name.capitalize()
 
     def has_output(self):
-        return len(self.lookup_choices) > 1
+        return bool(self.typeahead) or len(self.lookup_choices) > 1
 
     def expected_parameters(self):
         return [self.lookup_kwarg, self.lookup_kwarg_isnull]
@@ -113,8 +159,43 @@ class RelatedFieldListFilter(FieldListFilter):
     def field_choices(self, field):
         return field.get_choices(include_blank=False)
 
-    def choices(self):
-        for pk_val, val in self.lookup_choices:
+    @cached_property
+    def lookup_choices(self):
+        return self.get_lookup_choices(self.field)
+
+    def get_lookup_choices(self, field):
+        if self.cache_timeout is None:
+            return self.field_choices(field)
+
+        watch_model(self.other_model)
+        key = (
+            f"datatables:choices:{self.cache_prefix}:{type(self).__qualname__}:"
+            f"{self.field_path}:{get_language()}"
+        )
+        choices_cache = ModelCache(key, self.other_model, self.cache_timeout)
+        return choices_cache.get_or_set(lambda: self.field_choices(field))
+
+    def get_facet_queryset(self, qs):
+        return self.count_values(qs, self.lookup_kwarg[: -len("__in")])
+
+    def search_choices(self, term):
+        """Return at most typeahead_limit choices matching term."""
+        qs = self.other_model._default_manager.complex_filter(
+            self.field.get_limit_choices_to()
+        )
+        qs = IContainsSearch().filter(qs, self.typeahead, term)
+        if not qs.ordered:
+            qs = qs.order_by("pk")
+        field_name = self.field.target_field.attname
+        return [
+            (getattr(obj, field_name), str(obj)) for obj in qs[: self.typeahead_limit]
+        ]
+
+    def choices(self, choices=None):
+        if choices is None:
+            choices = self.lookup_choices
+
+        for pk_val, val in choices:
             yield {
                 "query_string": urlencode({self.lookup_kwarg: pk_val}),
                 "display": val,
@@ -142,6 +223,12 @@ class BooleanFieldListFilter(FieldListFilter):
     def expected_parameters(self):
         return [self.lookup_kwarg]
 
+    def get_facet_queryset(self, qs):
+        return self.count_values(qs, self.field_path)
+
+    def facet_lookup(self, value):
+        return "1" if value else "0"
+
     def choices(self):
         for lookup, title in self.lookup_choices:
             yield {
@@ -184,6 +271,9 @@ class ChoicesFieldListFilter(FieldListFilter):
     def expected_parameters(self):
         return [self.lookup_kwarg, self.lookup_kwarg_isnull]
 
+    def get_facet_queryset(self, qs):
+        return self.count_values(qs, self.field_path)
+
     def choices(self, choices=None):
         if not choices:
             choices = self.lookup_choices
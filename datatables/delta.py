@@ -0,0 +1,33 @@
+import base64
+import hashlib
+import json
+
+from .utils import ExactJSONEncoder
+
+
+def get_page_hash(pks):
+    data = json.dumps(pks, cls=ExactJSONEncoder, separators=(",", ":"))
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def encode_since(pks, version):
+    """Return a token for a page of rows with pks.
+
+    No row of the page has changed after version, the largest value of the
+    change tracking field on the page.
+    """
+    payload = {"p": get_page_hash(pks), "v": version}
+    data = json.dumps(payload, cls=ExactJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_since(token):
+    """Return the decoded token payload, or None if it can't be read."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(payload, dict) or not {"p", "v"} <= payload.keys():
+        return None
+    return payload
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+from .cache import aget_model_version
+
+
+class Broker:
+    """Fan out model changes to the event streams of this process.
+
+    Each stream has a queue of at most one message, so a burst of changes
+    only makes a client refetch its table once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, labels):
+        """Return a queue of changes to the models with labels."""
+        queue = asyncio.Queue(maxsize=1)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            for label in labels:
+                self.subscribers.setdefault(label, set()).add(subscriber)
+        return queue
+
+    def unsubscribe(self, labels, queue):
+        with self.lock:
+            for label in labels:
+                subscribers = self.subscribers.get(label, set())
+                subscribers.difference_update([s for s in subscribers if s[1] is queue])
+                if not subscribers:
+                    self.subscribers.pop(label, None)
+
+    def publish(self, label, message):
+        # Signals are sent from other threads than the one running the loop
+        with self.lock:
+            subscribers = list(self.subscribers.get(label, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(put_nowait, queue, message)
+
+
+def put_nowait(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+broker = Broker()
+
+
+def publish_change(sender, **kwargs):
+    label = sender._meta.label_lower
+    broker.publish(label, {"model": label})
+
+
+def watch_model(model):
+    """Publish saves and deletes of model to the broker."""
+    uid = f"datatables:events:{model._meta.label_lower}"
+    post_save.connect(publish_change, sender=model, dispatch_uid=uid)
+    post_delete.connect(publish_change, sender=model, dispatch_uid=uid)
+
+
+async def aget_versions(models):
+    return [await aget_model_version(model) for model in models]
+
+
+async def event_stream(models, heartbeat=15, retry=5000):
+    """Yield a server-sent change event whenever one of models is changed.
+
+    Changes made by other processes aren't seen by the broker, they're picked
+    up from the model versions in the cache every heartbeat seconds.
+    """
+    labels = [model._meta.label_lower for model in models]
+    queue = broker.subscribe(labels)
+    try:
+        versions = await aget_versions(models)
+        yield f"retry: {retry}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                message = None
+
+            current = await aget_versions(models)
+            if message is None and current == versions:
+                yield ": heartbeat\n\n"
+                continue
+
+            versions = current
+            yield f"event: change\ndata: {json.dumps(message or {})}\n\n"
+    finally:
+        broker.unsubscribe(labels, queue)
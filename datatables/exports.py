@@ -0,0 +1,429 @@
+import csv
+import io
+import json
+import tempfile
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldError
+from django.core.serializers.json import DjangoJSONEncoder
+
+INTEGER_FIELDS = {
+    "AutoField",
+    "BigAutoField",
+    "SmallAutoField",
+    "IntegerField",
+    "BigIntegerField",
+    "SmallIntegerField",
+    "PositiveIntegerField",
+    "PositiveBigIntegerField",
+    "PositiveSmallIntegerField",
+}
+
+
+def column_kind(field):
+    """Return the kind of values an export column of field holds."""
+    if field is None or field.choices:
+        return "string"
+    internal_type = field.get_internal_type()
+    if internal_type in INTEGER_FIELDS:
+        return "integer"
+    if internal_type == "FloatField":
+        return "float"
+    if internal_type == "DecimalField":
+        return "decimal"
+    if internal_type in ("BooleanField", "NullBooleanField"):
+        return "boolean"
+    if internal_type == "DateTimeField":
+        return "datetime"
+    if internal_type == "DateField":
+        return "date"
+    return "string"
+
+
+def to_string(value):
+    return None if value is None else str(value)
+
+
+class Export:
+    """Export the rows of a queryset.
+
+    Rows are read chunk_size at a time with QuerySet.iterator(), which uses
+    server-side cursors where the database supports them. Typed exports get
+    the values of the columns instead of their text representation.
+    """
+
+    content_type = "application/octet-stream"
+    extension = None
+    typed = False
+
+    def __init__(
+        self,
+        datatable,
+        queryset,
+        columns,
+        chunk_size=2000,
+        buffer_size=65536,
+        compress=False,
+    ):
+        self.datatable = datatable
+        self.queryset = queryset
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.compress = compress
+
+    def get_content_type(self):
+        return self.content_type
+
+    def get_extension(self):
+        return self.extension
+
+    def get_headers(self):
+        return [c[1] if isinstance(c, tuple) else c for c in self.columns]
+
+    def get_fields(self):
+        """Return the model field, or annotation output field, of each column.
+
+        Columns rendered by a view method have no field and are exported as
+        text.
+        """
+        annotations = self.queryset.query.annotations
+        fields = []
+        for column in self.columns:
+            if isinstance(column, tuple):
+                column = column[0]
+            if self.datatable.get_view_method(column):
+                fields.append(None)
+                continue
+            field = self.datatable.get_column_field(column)
+            if field is None and column in annotations:
+                try:
+                    field = annotations[column].output_field
+                except FieldError:
+                    pass
+            fields.append(field)
+        return fields
+
+    def get_rows(self):
+        """Return a tuple of (queryset, accessors) to read the rows from."""
+        qs, accessors = self.datatable.get_rows_queryset(
+            self.queryset, self.columns, raw=True, typed=self.typed
+        )
+        accessors = [accessor for _, accessor in accessors]
+        if self.typed:
+            # Values of unknown types are exported as text
+            kinds = [column_kind(field) for field in self.get_fields()]
+            accessors = [
+                (lambda row, a=a: to_string(a(row))) if kind == "string" else a
+                for a, kind in zip(accessors, kinds, strict=True)
+            ]
+        return qs, accessors
+
+    def read_batch(self, rows, accessors):
+        """Return the column values of the next chunk_size rows of rows."""
+        return [
+            [accessor(row) for accessor in accessors]
+            for row in islice(rows, self.chunk_size)
+        ]
+
+    def batches(self):
+        """Yield lists of rows, each row being a list of column values."""
+        qs, accessors = self.get_rows()
+        rows = qs.iterator(chunk_size=self.chunk_size)
+        while True:
+            batch = self.read_batch(rows, accessors)
+            if not batch:
+                return
+            yield batch
+
+    async def abatches(self):
+        qs, accessors = self.get_rows()
+        # Batches are read in a thread, QuerySet.aiterator() can't iterate
+        # values_list() querysets, and view methods and properties of model
+        # instances may query.
+        rows = qs.iterator(chunk_size=self.chunk_size)
+        read_batch = sync_to_async(self.read_batch)
+        while True:
+            batch = await read_batch(rows, accessors)
+            if not batch:
+                return
+            yield batch
+
+    def write(self, file, progress=None):
+        """Write the export to a binary file.
+
+        progress is called with the number of rows written after each batch.
+        """
+        raise NotImplementedError("subclasses of Export must provide a write() method")
+
+    def spool(self):
+        """Return a temporary file holding the export."""
+        file = tempfile.TemporaryFile()
+        self.write(file)
+        file.seek(0)
+        return file
+
+    def stream(self):
+        """Yield the export in chunks of about buffer_size bytes."""
+        with self.spool() as file:
+            yield from iter(lambda: file.read(self.buffer_size), b"")
+
+    async def astream(self):
+        with await sync_to_async(self.spool)() as file:
+            for chunk in iter(lambda: file.read(self.buffer_size), b""):
+                yield chunk
+
+
+class TextExport(Export):
+    """Export rows as lines of text.
+
+    The output is streamed as it is generated and is gzip compressed if
+    compress is set.
+    """
+
+    def get_content_type(self):
+        return "application/gzip" if self.compress else self.content_type
+
+    def get_extension(self):
+        return f"{self.extension}.gz" if self.compress else self.extension
+
+    def get_header(self):
+        return ""
+
+    def format_batch(self, batch):
+        raise NotImplementedError(
+            "subclasses of TextExport must provide a format_batch() method"
+        )
+
+    def chunks(self, progress=None):
+        buffer = io.StringIO()
+        buffer.write(self.get_header())
+        rows = 0
+        for batch in self.batches():
+            buffer.write(self.format_batch(batch))
+            rows += len(batch)
+            if progress:
+                progress(rows)
+            if buffer.tell() >= self.buffer_size:
+                yield self.flush(buffer)
+
+        yield buffer.getvalue()
+
+    async def achunks(self):
+        buffer = io.StringIO()
+        buffer.write(self.get_header())
+        async for batch in self.abatches():
+            buffer.write(self.format_batch(batch))
+            if buffer.tell() >= self.buffer_size:
+                yield self.flush(buffer)
+
+        yield buffer.getvalue()
+
+    def flush(self, buffer):
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    def get_compressor(self):
+        return zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip header
+
+    def stream(self, progress=None):
+        if not self.compress:
+            yield from self.chunks(progress)
+            return
+
+        compressor = self.get_compressor()
+        for chunk in self.chunks(progress):
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+    async def astream(self):
+        if not self.compress:
+            async for chunk in self.achunks():
+                yield chunk
+            return
+
+        compressor = self.get_compressor()
+        async for chunk in self.achunks():
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def write(self, file, progress=None):
+        for chunk in self.stream(progress):
+            file.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+
+
+class CsvExport(TextExport):
+    content_type = "text/csv"
+    extension = "csv"
+
+    def get_header(self):
+        return self.format_batch([self.get_headers()])
+
+    def format_batch(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        return buffer.getvalue()
+
+
+class NdjsonExport(TextExport):
+    """One JSON object per line, keyed by column name."""
+
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+    typed = True
+
+    def get_headers(self):
+        return [c[0] if isinstance(c, tuple) else c for c in self.columns]
+
+    def format_batch(self, batch):
+        headers = self.get_headers()
+        return "".join(
+            json.dumps(dict(zip(headers, row, strict=True)), cls=DjangoJSONEncoder)
+            + "\n"
+            for row in batch
+        )
+
+
+EXPORT_FORMATS = {
+    "csv": CsvExport,
+    "ndjson": NdjsonExport,
+}
+
+# The extra of the package that installs the requirements of a format
+EXPORT_EXTRAS = {
+    "xlsx": "xlsx",
+    "arrow": "arrow",
+    "parquet": "parquet",
+}
+
+try:
+    import xlsxwriter
+except ModuleNotFoundError:
+    pass
+else:
+
+    class XlsxExport(Export):
+        """Excel workbook written by xlsxwriter in constant memory mode.
+
+        The mode flushes every row to disk once the next one is started.
+        """
+
+        content_type = (
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+        extension = "xlsx"
+        typed = True
+
+        def write(self, file, progress=None):
+            workbook = xlsxwriter.Workbook(
+                file,
+                {
+                    "constant_memory": True,
+                    "remove_timezone": True,
+                    "default_date_format": "yyyy-mm-dd hh:mm:ss",
+                },
+            )
+            worksheet = workbook.add_worksheet()
+            header_format = workbook.add_format({"bold": True})
+            date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+            kinds = [column_kind(field) for field in self.get_fields()]
+            formats = [date_format if kind == "date" else None for kind in kinds]
+            decimals = [i for i, kind in enumerate(kinds) if kind == "decimal"]
+
+            worksheet.write_row(0, 0, self.get_headers(), header_format)
+            rows = 0
+            for batch in self.batches():
+                for row in batch:
+                    rows += 1
+                    for i in decimals:
+                        if row[i] is not None:
+                            row[i] = float(row[i])
+                    for col, (value, cell_format) in enumerate(
+                        zip(row, formats, strict=True)
+                    ):
+                        worksheet.write(rows, col, value, cell_format)
+                if progress:
+                    progress(rows)
+            workbook.close()
+
+    EXPORT_FORMATS["xlsx"] = XlsxExport
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ModuleNotFoundError:
+    pass
+else:
+
+    class ArrowExport(Export):
+        """Arrow IPC file with one record batch per chunk of rows."""
+
+        content_type = "application/vnd.apache.arrow.file"
+        extension = "arrow"
+        typed = True
+
+        def get_type(self, field):
+            kind = column_kind(field)
+            if kind == "integer":
+                return pyarrow.int64()
+            if kind == "decimal" and field.max_digits is not None:
+                return pyarrow.decimal128(field.max_digits, field.decimal_places)
+            if kind in ("float", "decimal"):
+                return pyarrow.float64()
+            if kind == "boolean":
+                return pyarrow.bool_()
+            if kind == "date":
+                return pyarrow.date32()
+            if kind == "datetime":
+                return pyarrow.timestamp("us", tz=str(self.datatable.timezone))
+            return pyarrow.string()
+
+        def get_schema(self):
+            return pyarrow.schema(
+                [
+                    (header, self.get_type(field))
+                    for header, field in zip(
+                        self.get_headers(), self.get_fields(), strict=True
+                    )
+                ]
+            )
+
+        def get_writer(self, file, schema):
+            return pyarrow.ipc.new_file(file, schema)
+
+        def write(self, file, progress=None):
+            schema = self.get_schema()
+            writer = self.get_writer(file, schema)
+            rows = 0
+            for batch in self.batches():
+                arrays = [
+                    pyarrow.array(values, type=field.type)
+                    for values, field in zip(
+                        zip(*batch, strict=True), schema, strict=True
+                    )
+                ]
+                writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+                rows += len(batch)
+                if progress:
+                    progress(rows)
+            writer.close()
+
+    class ParquetExport(ArrowExport):
+        """Parquet file with one row group per chunk of rows."""
+
+        content_type = "application/vnd.apache.parquet"
+        extension = "parquet"
+
+        def get_writer(self, file, schema):
+            return pyarrow.parquet.ParquetWriter(file, schema)
+
+    EXPORT_FORMATS["arrow"] = ArrowExport
+    EXPORT_FORMATS["parquet"] = ParquetExport
@@ -0,0 +1,166 @@
+import logging
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone, translation
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY = "datatables:export:{}"
+EXPORTS_DIR = "datatables/exports"
+
+
+class ThreadPoolBackend:
+    """Run export jobs on a thread pool in the current process."""
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self.executor = None
+
+    def submit(self, func, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="datatables-export"
+            )
+        self.executor.submit(self.run, func, *args)
+
+    def run(self, func, *args):
+        try:
+            func(*args)
+        finally:
+            # Connections are opened per thread and would otherwise be leaked
+            connections.close_all()
+
+
+default_backend = ThreadPoolBackend()
+
+
+def get_job(job_id):
+    return cache.get(JOB_KEY.format(job_id))
+
+
+def update_job(job, timeout, **fields):
+    job.update(fields)
+    cache.set(JOB_KEY.format(job["id"]), job, timeout)
+    return job
+
+
+def create_job(view, export_format, timeout, storage, backend):
+    """Snapshot the request of view into an export job and submit it to backend.
+
+    Everything needed to run the job is stored in the cache so that backends
+    only have to pass the job id on to run_job(). The job runs with the time
+    zone and language of the request so that it writes the same values as a
+    synchronous export.
+    """
+    view_class = type(view)
+    user = getattr(view.request, "user", None)
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "pending",
+        "rows_done": 0,
+        "rows_total": None,
+        "view": f"{view_class.__module__}.{view_class.__qualname__}",
+        "kwargs": view.kwargs,
+        "query": view.request.GET.urlencode(),
+        "user": user.pk if user is not None and user.is_authenticated else None,
+        "timezone": timezone.get_current_timezone_name(),
+        "language": translation.get_language(),
+        "format": export_format,
+        "timeout": timeout,
+        "storage": storage,
+        "file": None,
+        "filename": None,
+        "error": None,
+    }
+    update_job(job, timeout)
+    backend.submit(run_job, job["id"])
+    return job
+
+
+def get_storage(storage):
+    """Return default_storage or an instance of the storage class path."""
+    if storage is None:
+        return default_storage
+    return import_string(storage)()
+
+
+def get_user(user_id):
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import AnonymousUser
+
+    if user_id is None:
+        return AnonymousUser()
+    return get_user_model()._default_manager.get(pk=user_id)
+
+
+def run_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return
+
+    tz, language = job.get("timezone"), job.get("language")
+    with timezone.override(tz), translation.override(language):
+        try:
+            write_job(job)
+        except Exception:
+            # The error is shown to the user, the details are only logged
+            logger.exception("Export job %s failed", job_id)
+            error = gettext("The export failed.")
+            update_job(job, job["timeout"], status="failed", error=error)
+
+
+def write_job(job):
+    job_id, timeout = job["id"], job["timeout"]
+    update_job(job, timeout, status="running")
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict(job["query"])
+    request.user = get_user(job["user"])
+
+    view = import_string(job["view"])()
+    view.setup(request, **job["kwargs"])
+    view.init_datatable(request, **job["kwargs"])
+    export = view.get_export(job["format"])
+    rows_total, _ = view.datatable.count_strategy.count(export.queryset)
+    update_job(job, timeout, rows_total=rows_total)
+
+    storage = get_storage(job["storage"])
+    filename = f"{view.get_export_filename()}.{export.get_extension()}"
+    with tempfile.TemporaryFile() as file:
+        export.write(file, lambda rows: update_job(job, timeout, rows_done=rows))
+        file.seek(0)
+        name = storage.save(f"{EXPORTS_DIR}/{job_id}/{filename}", File(file))
+
+    update_job(job, timeout, status="done", file=name, filename=filename)
+
+
+def delete_expired_exports(storage, max_age):
+    """Delete the export files in storage that are older than max_age seconds.
+
+    Jobs are only kept in the cache for their timeout, files that are older
+    can't be downloaded anymore. Returns the names of the deleted files.
+    """
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    deleted = []
+    if not storage.exists(EXPORTS_DIR):
+        return deleted
+    for job_id in storage.listdir(EXPORTS_DIR)[0]:
+        path = f"{EXPORTS_DIR}/{job_id}"
+        for filename in storage.listdir(path)[1]:
+            name = f"{path}/{filename}"
+            if storage.get_modified_time(name) <= cutoff:
+                storage.delete(name)
+                deleted.append(name)
+        if storage.listdir(path) == ([], []):
+            storage.delete(path)
+    return deleted
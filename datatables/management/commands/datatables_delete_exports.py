@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from datatables.jobs import delete_expired_exports, get_storage
+from datatables.views import DatatableView
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the files of background export jobs that are older than "
+        "--max-age seconds. Run it regularly, for example from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=DatatableView.export_job_timeout,
+            help="Age in seconds after which files are deleted, defaults to "
+            "the export_job_timeout of DatatableView.",
+        )
+        parser.add_argument(
+            "--storage",
+            help="Import path of the storage class the files are saved to, "
+            "the export_storage of the views. Defaults to default_storage.",
+        )
+
+    def handle(self, *args, max_age, storage, verbosity, **options):
+        deleted = delete_expired_exports(get_storage(storage), max_age)
+        if verbosity > 1:
+            for name in deleted:
+                self.stdout.write(f"Deleted {name}")
+        if verbosity:
+            self.stdout.write(f"Deleted {len(deleted)} export files.")
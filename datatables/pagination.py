@@ -0,0 +1,175 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from .utils import ExactJSONEncoder
+
+KEY_PREFIX = "_keyset_"
+
+
+def encode_cursor(ordering, values, direction):
+    payload = {"o": ordering, "v": values, "d": direction}
+    data = json.dumps(payload, cls=ExactJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the decoded cursor payload, or None if it can't be read."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(payload, dict) or not {"o", "v", "d"} <= payload.keys():
+        return None
+    return payload
+
+
+class KeysetPaginator:
+    """Seek through a queryset from the row where the previous page ended.
+
+    Pages are read with the values of the last (or first) row of the previous
+    page instead of LIMIT/OFFSET. The ordering is completed with a pk
+    tie-breaker so that every row has a unique position. A cursor is only
+    honoured if it was created for the same ordering, otherwise the paginator
+    falls back to an offset. NULLs sort as larger than every other value in
+    both directions of the ordering.
+    """
+
+    def __init__(self, queryset, ordering, page_size):
+        self.ordering = list(ordering)
+        if not any(o.lstrip("-") == "pk" for o in self.ordering):
+            self.ordering.append("pk")
+        self.fields = [o.lstrip("-") for o in self.ordering]
+        self.descending = [o.startswith("-") for o in self.ordering]
+        self.page_size = page_size
+        self.queryset = queryset.annotate(
+            **{f"{KEY_PREFIX}{i}": models.F(f) for i, f in enumerate(self.fields)}
+        )
+
+    def _seek(self, values, backwards, inclusive=False):
+        query = models.Q()
+        for i, field in enumerate(self.fields):
+            # Rows after the cursor equal it on every earlier ordering column
+            # and come after it on this one.
+            q = self._after(field, values[i], self.descending[i] != backwards)
+            for prev_field, value in zip(self.fields[:i], values[:i], strict=True):
+                q &= self._equal(prev_field, value)
+            query |= q
+        if inclusive:
+            query |= models.Q(
+                *[
+                    self._equal(field, value)
+                    for field, value in zip(self.fields, values, strict=True)
+                ]
+            )
+        return query
+
+    def _after(self, field, value, descending):
+        """Return a Q for values of field after value, NULLs being the largest."""
+        if descending:
+            if value is None:
+                return models.Q(**{f"{field}__isnull": False})
+            return models.Q(**{f"{field}__lt": value})
+        if value is None:
+            return models.Q(pk__in=[])
+        return models.Q(**{f"{field}__gt": value}) | models.Q(
+            **{f"{field}__isnull": True}
+        )
+
+    def _equal(self, field, value):
+        if value is None:
+            return models.Q(**{f"{field}__isnull": True})
+        return models.Q(**{field: value})
+
+    def _order_by(self, backwards=False):
+        order_by = []
+        for field, descending in zip(self.fields, self.descending, strict=True):
+            if descending != backwards:
+                order_by.append(models.F(field).desc(nulls_first=True))
+            else:
+                order_by.append(models.F(field).asc(nulls_last=True))
+        return order_by
+
+    def get_keys(self, obj):
+        if isinstance(obj, tuple):
+            # The keys are added to the end of rows from values_list()
+            return list(obj[-len(self.fields) :])
+        return [getattr(obj, f"{KEY_PREFIX}{i}") for i in range(len(self.fields))]
+
+    def page(self, cursor=None, offset=0):
+        """Return a tuple of (rows, cursors) for the page after cursor.
+
+        The page precedes the cursor if it is a "previous" cursor, and is read
+        at offset if no valid cursor is given. cursors has the "next" and
+        "previous" cursors, and the "current" cursor that starts at the first
+        row of the page to load it again.
+        """
+        payload, qs = self.get_page_queryset(self.get_payload(cursor), offset)
+        return self.make_page(list(qs), payload, offset)
+
+    async def apage(self, cursor=None, offset=0):
+        payload, qs = self.get_page_queryset(self.get_payload(cursor), offset)
+        return self.make_page([row async for row in qs], payload, offset)
+
+    def get_payload(self, cursor):
+        """Return the payload of cursor if it was created for this ordering."""
+        payload = decode_cursor(cursor) if cursor else None
+        if payload and (
+            payload["o"] != self.ordering or len(payload["v"]) != len(self.fields)
+        ):
+            return None
+        return payload
+
+    def get_page_queryset(self, payload, offset):
+        """Return a tuple of (payload, queryset) of the page.
+
+        payload is None if the page is read at offset because the cursor's
+        values don't fit the ordering columns.
+        """
+        try:
+            return payload, self.get_seek_queryset(payload, offset)
+        except (ValueError, TypeError, ValidationError):
+            return None, self.get_seek_queryset(None, offset)
+
+    def get_seek_queryset(self, payload, offset):
+        # One extra row is fetched to tell if there is a page after this one.
+        qs = self.queryset
+        if payload is None:
+            return qs.order_by(*self._order_by())[offset : offset + self.page_size + 1]
+        if payload["d"] == "previous":
+            qs = qs.filter(self._seek(payload["v"], backwards=True))
+            return qs.order_by(*self._order_by(backwards=True))[: self.page_size + 1]
+        inclusive = payload["d"] == "current"
+        qs = qs.filter(self._seek(payload["v"], backwards=False, inclusive=inclusive))
+        return qs.order_by(*self._order_by())[: self.page_size + 1]
+
+    def make_page(self, rows, payload, offset):
+        if payload is None or payload["d"] == "current":
+            has_previous = offset > 0
+            has_next = len(rows) > self.page_size
+            rows = rows[: self.page_size]
+        elif payload["d"] == "previous":
+            has_previous = len(rows) > self.page_size
+            has_next = True
+            rows = rows[: self.page_size]
+            rows.reverse()
+        else:
+            has_previous = True
+            has_next = len(rows) > self.page_size
+            rows = rows[: self.page_size]
+
+        cursors = {"next": None, "previous": None, "current": None}
+        if rows and has_next:
+            cursors["next"] = encode_cursor(
+                self.ordering, self.get_keys(rows[-1]), "next"
+            )
+        if rows:
+            first = self.get_keys(rows[0])
+            cursors["current"] = encode_cursor(self.ordering, first, "current")
+            if has_previous:
+                cursors["previous"] = encode_cursor(self.ordering, first, "previous")
+
+        return rows, cursors
@@ -0,0 +1,152 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+
+
+def tokenize(search):
+    """Split search into terms, quoted phrases are kept as one term."""
+    terms = []
+    for bit in smart_split(search):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1] and len(bit) > 1:
+            bit = unescape_string_literal(bit)
+        if bit:
+            terms.append(bit)
+    return terms
+
+
+class IContainsSearch:
+    """Match rows where every term is found in at least one of the fields.
+
+    Terms are matched with the lookup, icontains by default.
+    """
+
+    lookup = "icontains"
+
+    def __init__(self, lookup=None):
+        if lookup is not None:
+            self.lookup = lookup
+
+    def filter(self, qs, fields, search):
+        query = models.Q()
+        for term in tokenize(search):
+            term_query = models.Q()
+            for field in fields:
+                term_query |= models.Q(**{f"{field}__{self.lookup}": term})
+            query &= term_query
+        return qs.filter(query)
+
+
+class TrigramSearch(IContainsSearch):
+    """Match terms by trigram word similarity on PostgreSQL.
+
+    A GIN or GiST index with gin_trgm_ops on each field lets this use an
+    index, it needs the pg_trgm extension and django.contrib.postgres in
+    INSTALLED_APPS.
+    """
+
+    lookup = "trigram_word_similar"
+
+
+class PostgresSearch:
+    """Full text search on PostgreSQL.
+
+    The search vector is built from the fields unless vector_field names a
+    SearchVectorField kept up to date on the model. Either way a GIN index on
+    the same expression is needed to avoid scanning the table.
+    """
+
+    def __init__(self, config=None, search_type="plain", vector_field=None):
+        self.config = config
+        self.search_type = search_type
+        self.vector_field = vector_field
+
+    def filter(self, qs, fields, search):
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+
+        terms = tokenize(search)
+        if not terms:
+            return qs
+
+        query = SearchQuery(
+            " ".join(terms), config=self.config, search_type=self.search_type
+        )
+        if self.vector_field:
+            return qs.filter(**{self.vector_field: query})
+        vector = SearchVector(*fields, config=self.config)
+        return qs.alias(_search_vector=vector).filter(_search_vector=query)
+
+
+class SqliteFtsSearch:
+    """Full text search with an SQLite FTS5 table that indexes the model's table.
+
+    The FTS table is created by the statements from create_sql(), for example
+    in a RunSQL migration. Terms are prefix matched so that results narrow
+    while the user types.
+    """
+
+    def __init__(self, table=None):
+        self.table = table
+
+    def get_table(self, model):
+        return self.table or f"{model._meta.db_table}_fts"
+
+    def get_columns(self, model, fields):
+        """Return the columns of the fields that are stored on the model."""
+        opts = model._meta
+        columns = []
+        for name in fields:
+            if "__" in name:
+                continue
+            try:
+                columns.append(opts.get_field(name).column)
+            except FieldDoesNotExist:
+                continue
+        return columns
+
+    def create_sql(self, model, fields):
+        """Return the statements that create the FTS table for fields.
+
+        The statements also keep it in sync with the model's table with
+        triggers and fill it.
+        """
+        table = model._meta.db_table
+        fts = self.get_table(model)
+        pk = model._meta.pk.column
+        columns = self.get_columns(model, fields)
+        names = ", ".join(columns)
+        new = ", ".join(f"new.{c}" for c in columns)
+        old = ", ".join(f"old.{c}" for c in columns)
+        delete = (
+            f"INSERT INTO {fts}({fts}, rowid, {names}) "
+            f"VALUES ('delete', old.{pk}, {old});"
+        )
+        insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new});"
+        return [
+            f"CREATE VIRTUAL TABLE {fts} USING fts5("
+            f"{names}, content='{table}', content_rowid='{pk}')",
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} "
+            f"BEGIN {delete} {insert} END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+
+    def get_match(self, model, fields, terms):
+        # Quoting makes FTS5 read every term as a string instead of syntax
+        match = " AND ".join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+        columns = self.get_columns(model, fields)
+        if columns:
+            match = "{{{}}} : ({})".format(" ".join(columns), match)
+        return match
+
+    def filter(self, qs, fields, search):
+        terms = tokenize(search)
+        if not terms:
+            return qs
+
+        fts = self.get_table(qs.model)
+        match = self.get_match(qs.model, fields, terms)
+        return qs.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        )
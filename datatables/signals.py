@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent with the view and its timing record after a timed JSON response is built
+request_timed = Signal()
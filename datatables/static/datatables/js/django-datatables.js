@@ -90,10 +90,110 @@ function parseUrlFragment(index) {
     return {};
 }
 
+function formatCount(count, approximate) {
+    if (!approximate) {
+        return count.toLocaleString();
+    }
+    const format = new Intl.NumberFormat(undefined, { notation: 'compact', maximumFractionDigits: 1 });
+    return '~' + format.format(count);
+}
+
+function formatRelativeTime(date) {
+    const format = new Intl.RelativeTimeFormat(undefined, { numeric: 'auto' });
+    const seconds = (date.getTime() - Date.now()) / 1000;
+    const units = [['year', 31536000], ['month', 2592000], ['week', 604800], ['day', 86400], ['hour', 3600], ['minute', 60]];
+    for (const [unit, size] of units) {
+        if (Math.abs(seconds) >= size) {
+            return format.format(Math.trunc(seconds / size), unit);
+        }
+    }
+    return format.format(Math.trunc(seconds), 'second');
+}
+
+function renderDatetime(relative, timeZone) {
+    // Render ISO or epoch datetimes sent by the server as "YYYY-MM-DD HH:MM"
+    // in the time zone of the request, with the relative time if asked for.
+    const options = {
+        year: 'numeric', month: '2-digit', day: '2-digit',
+        hour: '2-digit', minute: '2-digit', hourCycle: 'h23',
+    };
+    let format;
+    try {
+        format = new Intl.DateTimeFormat('en-US', Object.assign({ timeZone: timeZone }, options));
+    } catch (e) { // Unknown time zone, use the browser's
+        format = new Intl.DateTimeFormat('en-US', options);
+    }
+    return function (data, type) {
+        const date = typeof data === 'number' || typeof data === 'string' ? new Date(data) : null;
+        if (!date || isNaN(date)) {
+            return data;
+        }
+        if (type === 'sort' || type === 'type') {
+            return date.getTime();
+        }
+        const parts = {};
+        format.formatToParts(date).forEach(part => { parts[part.type] = part.value; });
+        const text = `${parts.year}-${parts.month}-${parts.day} ${parts.hour}:${parts.minute}`;
+        return relative ? `${text} (${formatRelativeTime(date)})` : text;
+    };
+}
+
+function updateFacets(id, facets) {
+    // Show the number of matching rows next to each filter choice.
+    $(".datatable-filters." + id + " input:checkbox.datatable-filter[name]").each(function () {
+        const lookup = this.name.split('=')[0];
+        if (!(lookup in facets)) {
+            return;
+        }
+        const label = $(this).closest('label');
+        let badge = label.find('.datatable-facet');
+        if (!badge.length) {
+            badge = $('<span class="badge badge-light ml-1 datatable-facet"></span>').appendTo(label);
+        }
+        badge.text((facets[lookup][this.name] || 0).toLocaleString());
+    });
+}
+
+function runExportJob(button, url) {
+    // Start an export job and poll its status until the file can be downloaded.
+    if (button.hasClass('disabled')) {
+        return;
+    }
+    const label = button.text();
+    button.addClass('disabled');
+    const done = () => {
+        button.removeClass('disabled');
+        button.text(label);
+    };
+    const poll = job => {
+        if (job.status === 'done') {
+            done();
+            window.location = job.downloadUrl;
+        } else if (job.status === 'failed') {
+            done();
+            alert(job.error);
+        } else {
+            if (job.rowsTotal) {
+                button.text(`${label} (${Math.floor(100 * job.rowsDone / job.rowsTotal)}%)`);
+            }
+            setTimeout(() => $.getJSON(job.statusUrl).done(poll).fail(done), 1000);
+        }
+    };
+    $.getJSON(url).done(poll).fail(done);
+}
+
 function datatableify(table, index) {
     const datatable = $(table);
     const id = datatable.data('id');
     const page_length = datatable.data('length');
+    const keyset = datatable.data('keyset');
+    const countless = datatable.data('countless');
+    const config_ajax = (datatable.data('config') || {}).ajax;
+    const ajax_url = typeof config_ajax === 'string' ? config_ajax :
+        (config_ajax && config_ajax.url) || '?format=json';
+    // Cursors of the last drawn page, used to seek to its neighbours.
+    let cursor = { start: null, next: null, previous: null };
+    let pending_start = null;
     let page_index = 0;
     let search_history = null;
     let order_history = null;
@@ -129,9 +229,118 @@ function datatableify(table, index) {
         }
     }
 
+    const request_data = d => {
+        if (search_history !== null) {
+            d['search']['value'] = search_history;
+        }
+        if (order_history !== null) {
+            d['order'] = order_history
+            order_history = null;
+        }
+
+        var searchstring = $("form:eq(0) :input").val();
+        if (searchstring)
+            d["main_search"] = searchstring;
+        d["filters"] = [];
+        $(".datatable-filter-date").each(function () {
+            // Simple verification to avoid uninitialized or cleared values.
+            const param = $(this).attr('param')
+            if (/.+=.+/.test(param)) {
+                d["filters"].push(param)
+            }
+        });
+        $(".datatable-filters." + id + " input:checkbox:checked.datatable-filter").each(function () {
+            d["filters"].push(this.name);
+        });
+        $(".datatable-filters." + id + " input:radio:checked.datatable-filter").each(function () {
+            d["select"] = this.value
+        });
+        if (keyset && cursor.start !== null) {
+            if (d['start'] === cursor.start + d['length'] && cursor.next) {
+                d['cursor'] = cursor.next;
+            } else if (d['start'] === cursor.start - d['length'] && cursor.previous) {
+                d['cursor'] = cursor.previous;
+            } else if (d['start'] === cursor.start && d['start'] > 0 && cursor.current) {
+                // Reloads of a deep page start again from its first row
+                d['cursor'] = cursor.current;
+            }
+        }
+        pending_start = d['start'];
+
+        d["visible"] = [];
+        $(".table__header th:visible").each(function () {
+            d["visible"].push($(this).attr('name'));
+        });
+
+        history.replaceState(null, '', buildUrlFragment(index, d))
+    };
+
+    const receive = json => {
+        if (json.since !== undefined) {
+            since = json.since;
+        }
+        if (json.facets) {
+            updateFacets(id, json.facets);
+        }
+        if (json.cursor) {
+            cursor = { start: pending_start, ...json.cursor };
+        }
+        if (countless) {
+            // Pretend there is exactly one more row when there is a
+            // next page so that only the "next" button is enabled.
+            const records = pending_start + json.data.length + (json.hasMore ? 1 : 0);
+            json.recordsTotal = records;
+            json.recordsFiltered = records;
+        }
+        return json;
+    };
+
+    // The last response, sent again by the server as a 304 when the
+    // table hasn't changed.
+    let last_response = { key: null, etag: null, json: null };
+    // Token of the rows on the page for delta updates, and a full response
+    // fetched by a delta update to draw without requesting it again.
+    let since = null;
+    let prefetched = null;
+    const ajax = (d, callback, dt_settings) => {
+        request_data(d);
+        const params = Object.assign({}, d);
+        delete params.draw;
+        const key = $.param(params);
+        if (prefetched !== null && prefetched.key === key) {
+            const json = receive(Object.assign({}, prefetched.json));
+            prefetched = null;
+            dt_settings.json = json;
+            callback(json);
+            return;
+        }
+        const headers = {};
+        if (last_response.key === key && last_response.etag) {
+            headers['If-None-Match'] = last_response.etag;
+        }
+        $.ajax({ url: ajax_url, data: d, dataType: 'json', cache: false, headers: headers })
+            .done((json, status, xhr) => {
+                if (xhr.status === 304) {
+                    json = last_response.json;
+                } else {
+                    last_response = { key: key, etag: xhr.getResponseHeader('ETag'), json: json };
+                }
+                json = receive(Object.assign({}, json));
+                // Like DataTables' own ajax, for ajax.json() and infoCallback
+                dt_settings.json = json;
+                callback(json);
+            })
+            .fail((xhr, status) => {
+                if (status !== 'abort') {
+                    $.fn.dataTable.ext.internal._fnLog(dt_settings, 0, 'Ajax error', 7);
+                }
+            });
+    };
+
     const default_settings = {
         serverSide: true,
         paging: true,
+        pagingType: countless ? 'simple' : 'simple_numbers',
         pageLength: page_length,
         displayStart: page_index * page_length,
         info: true,
@@ -143,52 +352,110 @@ function datatableify(table, index) {
             { visible: false, targets: "hidden" },
         ],
         dom: 'rti<"pagination"p>',
-        ajax: {
-            url: "?format=json",
-            data: d => {
-                if (search_history !== null) {
-                    d['search']['value'] = search_history;
-                }
-                if (order_history !== null) {
-                    d['order'] = order_history
-                    order_history = null;
-                }
-
-                var searchstring = $("form:eq(0) :input").val();
-                if (searchstring)
-                    d["main_search"] = searchstring;
-                d["filters"] = [];
-                $(".datatable-filter-date").each(function () {
-                    // Simple verification to avoid uninitialized or cleared values.
-                    const param = $(this).attr('param')
-                    if (/.+=.+/.test(param)) {
-                        d["filters"].push(param)
-                    }
-                });
-                $(".datatable-filters." + id + " input:checkbox:checked.datatable-filter").each(function () {
-                    d["filters"].push(this.name);
-                });
-                $(".datatable-filters." + id + " input:radio:checked.datatable-filter").each(function () {
-                    d["select"] = this.value
-                });
-                d["visible"] = [];
-                $(".table__header th:visible").each(function () {
-                    d["visible"].push($(this).attr('name'));
-                });
-
-                history.replaceState(null, '', buildUrlFragment(index, d))
-            },
+        ajax: ajax,
+        infoCallback: function (settings, start, end, max, total, pre) {
+            const json = settings.json;
+            if (countless) {
+                return total ? `${start.toLocaleString()} - ${end.toLocaleString()}` : pre;
+            }
+            if (!json || !(json.recordsTotalApproximate || json.recordsFilteredApproximate)) {
+                return pre;
+            }
+            const language = settings.oLanguage;
+            let info = total ? language.sInfo : language.sInfoEmpty;
+            if (total !== max) {
+                info += ' ' + language.sInfoFiltered;
+            }
+            return info
+                .replace(/_START_/g, start.toLocaleString())
+                .replace(/_END_/g, end.toLocaleString())
+                .replace(/_TOTAL_/g, formatCount(total, json.recordsFilteredApproximate))
+                .replace(/_MAX_/g, formatCount(max, json.recordsTotalApproximate));
         },
         createdRow: function (row, data, dataIndex) {
             $(row).addClass("table__row");
             $(row).addClass(data.html_class);
         },
     }
-    let data_func = default_settings.ajax.data;
+    const datetime_columns = datatable.data('datetime-columns') || {};
+    datatable.find('.table__header th').each(function (column) {
+        const render = datetime_columns[$(this).attr('name')];
+        if (render) {
+            default_settings.columnDefs.push({
+                targets: column,
+                render: renderDatetime(render === 'relative', datatable.data('timezone')),
+            });
+        }
+    });
     const settings = Object.assign(default_settings, datatable.data('config'));
-    settings.ajax.data = data_func;
+    settings.ajax = ajax;
     var table = datatable.DataTable(settings);
 
+    const refresh = () => {
+        // Ask for the rows that changed since the last response and update
+        // them in place, or redraw the page if other rows are on it now.
+        const params = Object.assign({}, table.ajax.params());
+        delete params.draw;
+        const key = $.param(params);
+        params.since = since;
+        $.ajax({ url: ajax_url, data: params, dataType: 'json', cache: false }).done(json => {
+            const last = table.ajax.json();
+            if (!json.delta) {
+                prefetched = { key: key, json: json };
+                table.ajax.reload(null, false);
+            } else if (!last || json.recordsTotal !== last.recordsTotal || json.recordsFiltered !== last.recordsFiltered) {
+                table.ajax.reload(null, false);
+            } else {
+                json.data.forEach(item => {
+                    table.rows().every(function () {
+                        const data = this.data();
+                        if (data.DT_RowId === item.DT_RowId) {
+                            this.data(item);
+                            $(this.node()).removeClass(data.html_class).addClass(item.html_class);
+                        }
+                    });
+                });
+                since = json.since;
+            }
+        });
+    };
+
+    const update = () => {
+        if (since !== null) {
+            refresh();
+        } else {
+            table.ajax.reload(null, false);
+        }
+    };
+
+    // Changes are pushed over server-sent events when the server supports
+    // it, polling is used while the event stream isn't open.
+    let events = null;
+    if (datatable.data('live') && window.EventSource) {
+        let update_timer = null;
+        const events_url = new URL(ajax_url, window.location.href);
+        events_url.searchParams.set('format', 'events');
+        events = new EventSource(events_url);
+        events.addEventListener('change', () => {
+            clearTimeout(update_timer);
+            update_timer = setTimeout(update, 250);
+        });
+        datatable.on('destroy.dt', () => events.close());
+    }
+
+    const update_interval = datatable.data('update-interval');
+    if (update_interval > 0) {
+        const poll = setInterval(function () {
+            if (events !== null && events.readyState === EventSource.OPEN) {
+                return;
+            }
+            if (document.visibilityState === 'visible' && datatable.is(':visible')) {
+                update();
+            }
+        }, update_interval);
+        datatable.on('destroy.dt', () => clearInterval(poll));
+    }
+
     const date_filter_selector = $('.datatable-filter-date')
     date_filter_selector.each(function () {
         new DateTime($(this), {
@@ -235,10 +502,56 @@ function datatableify(table, index) {
         search_history = null;
     }
 
-    $('.csv-button.' + id).on('click', function (e) {
+    $('.export-button.' + id).on('click', function (e) {
         var params = table.ajax.params();
-        var href = "?format=csv&" + $.param(params);
+        var href = "?format=" + $(this).data('format') + "&" + $.param(params);
+        if ($(this).data('compress')) {
+            href += "&compress=" + $(this).data('compress');
+        }
         $(this).attr("href", href);
+        if ($(this).data('async')) {
+            e.preventDefault();
+            runExportJob($(this), href + "&export=async");
+        }
+    });
+
+    let typeahead_timer = null;
+    $('.datatable-filter-typeahead.' + id).on('input', function () {
+        const input = $(this);
+        const results = input.parent().siblings('.datatable-filter-typeahead-results');
+        clearTimeout(typeahead_timer);
+        typeahead_timer = setTimeout(function () {
+            $.getJSON('', { format: 'choices', filter: input.data('filter'), q: input.val() }, function (json) {
+                // Keep the choices that are checked
+                results.find('input:checkbox:not(:checked)').closest('a').remove();
+                const checked = results.find('input:checkbox').map(function () { return this.name; }).get();
+                json.results.forEach(function (choice) {
+                    const name = encodeURI(choice.query_string);
+                    if (checked.indexOf(name) > -1) {
+                        return;
+                    }
+                    const checkbox = $('<input type="checkbox" class="datatable-filter ' + id + '" />')
+                        .attr('name', name)
+                        .on('change', function () { table.draw(); });
+                    const label = $('<label class="input-checkbox"></label>')
+                        .append(checkbox, '<div class="input-checkbox__checkmark mr-3"></div>')
+                        .append(document.createTextNode(choice.display));
+                    results.append($('<a class="dropdown-item pl-0"></a>').append(label));
+                });
+            });
+        }, 300);
+    });
+
+    let column_search_timer = null;
+    $('.column-search.' + id).on('input', function () {
+        // Range searches are sent as "from,to"
+        const value = $(this).closest('th').find('.column-search')
+            .map(function () { return this.value; }).get().join(',');
+        const column = table.column($(this).data('column'));
+        clearTimeout(column_search_timer);
+        column_search_timer = setTimeout(function () {
+            column.search(value.replace(/^,$/, '')).draw();
+        }, 300);
     });
 
     $('.toggle-column.' + id).on('change', function (e) {
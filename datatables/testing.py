@@ -0,0 +1,130 @@
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+
+def get_column_name(column):
+    return column[0] if isinstance(column, tuple) else column
+
+
+def get_view(view_class, params, user=None, **kwargs):
+    request = RequestFactory().get("/", params)
+    if user is not None:
+        request.user = user
+    view = view_class()
+    view.setup(request, **kwargs)
+    view.init_datatable(request, **kwargs)
+    return view
+
+
+def count_queries(view_class, params, columns=None, user=None, **kwargs):
+    """Return the number of queries run to render the response of view_class.
+
+    The response is to a GET request with params, its streamed content is
+    read as well. If columns is given the table only has those columns.
+    """
+    view = get_view(view_class, params, user, **kwargs)
+    request = view.request
+    if columns is not None:
+        view.datatable.columns = columns
+
+    with CaptureQueriesContext(connection) as queries:
+        if view.view_is_async:
+            response = async_to_sync(view.get)(request, **kwargs)
+        else:
+            response = view.get(request, **kwargs)
+        if getattr(response, "is_async", False):
+            async_to_sync(read_async)(response.streaming_content)
+        elif response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return len(queries)
+
+
+async def read_async(content):
+    async for _ in content:
+        pass
+
+
+def get_query_counts(view_class, formats, params, user=None, **kwargs):
+    """Return the query counts of each format.
+
+    The queries are counted for the whole table and for each column on its
+    own, keyed by (format, column name or None).
+    """
+    columns = get_view(view_class, params, user, **kwargs).datatable.columns
+    counts = {}
+    for export_format in formats:
+        format_params = {**params, "format": export_format}
+        if export_format != "json":
+            format_params["visible[]"] = [get_column_name(c) for c in columns]
+        counts[export_format, None] = count_queries(
+            view_class, format_params, user=user, **kwargs
+        )
+        for column in columns:
+            name = get_column_name(column)
+            if export_format == "json":
+                # JSON responses always have every column of the table
+                count = count_queries(
+                    view_class, format_params, [column], user=user, **kwargs
+                )
+            else:
+                column_params = {**format_params, "visible[]": [name]}
+                count = count_queries(view_class, column_params, user=user, **kwargs)
+            counts[export_format, name] = count
+    return counts
+
+
+def assert_constant_queries(
+    view_class,
+    create_rows,
+    sizes=(2, 10),
+    formats=("json", "csv"),
+    params=None,
+    user=None,
+    **kwargs,
+):
+    """Fail if the queries of view_class grow with the number of rows.
+
+    The queries of the JSON and CSV responses are counted. create_rows(count)
+    is called to add count rows to the table, which should start out empty,
+    first to reach the smaller of sizes and then the larger. The responses
+    are requested with params and a page size that fits every row, and the
+    queries are counted for the whole table and for each column on its own
+    to report the columns that cause the extra queries. kwargs are passed on
+    to the view as URL keyword arguments.
+    """
+    small, large = sizes
+    params = {"length": large, **(params or {})}
+
+    create_rows(small)
+    # Warm up caches that are filled on the first request
+    get_query_counts(view_class, formats, params, user=user, **kwargs)
+    small_counts = get_query_counts(view_class, formats, params, user=user, **kwargs)
+    create_rows(large - small)
+    large_counts = get_query_counts(view_class, formats, params, user=user, **kwargs)
+
+    errors = []
+    for export_format in formats:
+        before = small_counts[export_format, None]
+        after = large_counts[export_format, None]
+        if after <= before:
+            continue
+
+        columns = []
+        for (key_format, name), count in small_counts.items():
+            grown = large_counts[key_format, name]
+            if key_format == export_format and name is not None and grown > count:
+                columns.append(f"{name!r} ({count} -> {grown})")
+        errors.append(
+            f"{export_format}: {before} queries with {small} rows, {after} with "
+            f"{large} rows. Columns whose queries grow: "
+            f"{', '.join(columns) or 'none on their own'}"
+        )
+
+    if errors:
+        raise AssertionError(
+            f"The queries of {view_class.__qualname__} grow with the number of "
+            "rows.\n" + "\n".join(errors)
+        )
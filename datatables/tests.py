@@ -0,0 +1,1267 @@
+import asyncio
+import base64
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import skipUnless
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+from django.utils.html import escape, strip_tags
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    pa = pq = None
+
+try:
+    import xlsxwriter
+except ModuleNotFoundError:
+    xlsxwriter = None
+
+from datatables.cache import VERSION_KEY, get_model_version
+from datatables.concurrency import QueryExecutor, can_run_concurrently
+from datatables.counts import (
+    EstimatedCount,
+    ExactCount,
+    ReltuplesCount,
+    ThresholdCount,
+)
+from datatables.datatable import Datatable
+from datatables.delta import encode_since
+from datatables.events import broker, event_stream
+from datatables.exports import EXPORT_FORMATS
+from datatables.jobs import get_job
+from datatables.pagination import KeysetPaginator, encode_cursor
+from datatables.search import SqliteFtsSearch
+from datatables.signals import request_timed
+from datatables.testing import assert_constant_queries
+from datatables.views import AsyncDatatableView, DatatableView
+from example.models import Job, Person
+from example.views import PersonTable
+
+EXPORT_DIR = tempfile.mkdtemp(prefix="datatables-tests-")
+UPDATED = datetime(2024, 5, 6, 7, 8, tzinfo=dt_timezone.utc)
+
+
+def get_response(view_class, params, **kwargs):
+    request = RequestFactory().get("/", params, **kwargs)
+    view = view_class.as_view()
+    if view_class.view_is_async:
+        return async_to_sync(view)(request)
+    return view(request)
+
+
+def get_json(view_class, params):
+    return json.loads(get_response(view_class, {"format": "json", **params}).content)
+
+
+def create_persons(count, start=0):
+    jobs = [Job.objects.create(name=f"Job {i}") for i in range(3)] + [None]
+    return [
+        Person.objects.create(
+            first_name=f"First {i}",
+            last_name=f"Last {i % 4}",
+            date_of_birth=date(1990, 1, 1) + timedelta(days=i),
+            job=jobs[i % 4],
+            education=None if i % 3 == 0 else "Bachelor",
+        )
+        for i in range(start, start + count)
+    ]
+
+
+class KeysetPersonTable(PersonTable):
+    keyset_pagination = True
+    paginate_by = 3
+
+
+class KeysetValuesPersonTable(KeysetPersonTable):
+    columns = ["last_name", "education", "job__name", "pk"]
+
+
+class AsyncKeysetPersonTable(AsyncDatatableView, KeysetValuesPersonTable):
+    pass
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(10)
+
+    def walk(self, view_class, column, direction="asc"):
+        """Return the pks of each page seeking forward and then back."""
+        params = {"length": 3, "order[0][column]": column, "order[0][dir]": direction}
+        pages = []
+        start, cursor = 0, {}
+        while True:
+            result = get_json(view_class, {**params, "start": start, **cursor})
+            pages.append([int(row["pk"]) for row in result["data"]])
+            if not result["hasMore"]:
+                break
+            start, cursor = start + 3, {"cursor": result["cursor"]["next"]}
+
+        back = [pages[-1]]
+        while result["cursor"]["previous"]:
+            start -= 3
+            result = get_json(
+                view_class,
+                {**params, "start": start, "cursor": result["cursor"]["previous"]},
+            )
+            back.insert(0, [int(row["pk"]) for row in result["data"]])
+        self.assertEqual(back, pages)
+        return pages
+
+    def offset_pages(self, ordering):
+        pks = list(Person.objects.order_by(*ordering).values_list("pk", flat=True))
+        return [pks[i : i + 3] for i in range(0, len(pks), 3)]
+
+    def test_seeks_past_nulls(self):
+        nulls_last = [F("education").asc(nulls_last=True), "pk"]
+        nulls_first = [F("education").desc(nulls_first=True), "pk"]
+        self.assertEqual(self.walk(KeysetPersonTable, 5), self.offset_pages(nulls_last))
+        self.assertEqual(
+            self.walk(KeysetPersonTable, 5, "desc"), self.offset_pages(nulls_first)
+        )
+
+    def test_seeks_past_null_relations(self):
+        ordering = [F("job__name").asc(nulls_last=True), "pk"]
+        expected = self.offset_pages(ordering)
+        self.assertEqual(self.walk(KeysetValuesPersonTable, 2), expected)
+        self.assertEqual(self.walk(AsyncKeysetPersonTable, 2), expected)
+
+    def test_current_cursor_reloads_page(self):
+        params = {"length": 3, "order[0][column]": 5, "order[0][dir]": "asc"}
+        first = get_json(KeysetPersonTable, {**params, "start": 0})
+        second = get_json(
+            KeysetPersonTable,
+            {**params, "start": 3, "cursor": first["cursor"]["next"]},
+        )
+        # A row before the page doesn't move the rows of a reload
+        Person.objects.filter(pk=first["data"][0]["pk"]).delete()
+        reload = get_json(
+            KeysetPersonTable,
+            {**params, "start": 3, "cursor": second["cursor"]["current"]},
+        )
+        self.assertEqual(reload["data"], second["data"])
+        self.assertTrue(reload["hasMore"])
+
+
+def create_users(count):
+    joined = datetime(2024, 5, 6, 7, 8, 9, tzinfo=dt_timezone.utc)
+    return [
+        User.objects.create(
+            username=f"u{i}", date_joined=joined + timedelta(microseconds=i)
+        )
+        for i in range(count)
+    ]
+
+
+class CountlessPersonTable(PersonTable):
+    countless_pagination = True
+
+
+class CountlessPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(7)
+
+    def test_pages_without_counting(self):
+        pages = []
+        for start in (0, 3, 6):
+            with self.assertNumQueries(1):
+                pages.append(
+                    get_json(
+                        CountlessPersonTable,
+                        {"start": start, "length": 3, "order[0][column]": 0},
+                    )
+                )
+        for page in pages:
+            self.assertEqual(page["recordsTotal"], -1)
+            self.assertEqual(page["recordsFiltered"], -1)
+        self.assertEqual([page["hasMore"] for page in pages], [True, True, False])
+        self.assertEqual([len(page["data"]) for page in pages], [3, 3, 1])
+
+    def test_filtered_last_page(self):
+        params = {"length": 4, "filters[]": "education__in=Bachelor"}
+        with self.assertNumQueries(1):
+            result = get_json(CountlessPersonTable, params)
+        self.assertFalse(result["hasMore"])
+        self.assertEqual(len(result["data"]), 4)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_users(5)
+
+    def walk(self, ordering, direction="next"):
+        paginator = KeysetPaginator(User.objects.all(), ordering, 2)
+        rows, cursors = paginator.page()
+        pages = [[user.username for user in rows]]
+        while cursors["next"] and len(pages) < 5:
+            rows, cursors = paginator.page(cursors["next"])
+            pages.append([user.username for user in rows])
+        return pages
+
+    def test_seeks_by_microseconds(self):
+        self.assertEqual(
+            self.walk(["date_joined"]), [["u0", "u1"], ["u2", "u3"], ["u4"]]
+        )
+        self.assertEqual(
+            self.walk(["-date_joined"]), [["u4", "u3"], ["u2", "u1"], ["u0"]]
+        )
+
+    def test_invalid_cursor_falls_back_to_offset(self):
+        paginator = KeysetPaginator(User.objects.order_by("pk"), ["pk"], 2)
+        for values in (["zzz"], [[1]]):
+            cursor = encode_cursor(["pk"], values, "next")
+            rows, cursors = paginator.page(cursor, offset=2)
+            self.assertEqual([user.username for user in rows], ["u2", "u3"])
+            self.assertIsNotNone(cursors["previous"])
+
+
+class AnnotatedPersonTable(PersonTable):
+    # Names of view settings are columns of the queryset, not view methods
+    columns = ["first_name", "facets", "timing", "job__name"]
+
+    def get_queryset(self):
+        return Person.objects.annotate(facets=Value("f"), timing=Value(1))
+
+
+class ViewMethodColumnTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(2)
+
+    def test_view_settings_are_not_view_methods(self):
+        result = get_json(AnnotatedPersonTable, {"length": 5})
+        self.assertEqual([row["facets"] for row in result["data"]], ["f", "f"])
+        self.assertEqual([row["timing"] for row in result["data"]], ["1", "1"])
+        self.assertIn("First 0", result["data"][0]["first_name"])
+
+
+class CachedPersonTable(PersonTable):
+    json_cache_timeout = 60
+
+
+class JsonCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(2)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        response = get_response(CachedPersonTable, {"format": "json"})
+        self.assertEqual(response.status_code, 200)
+        response = get_response(
+            CachedPersonTable,
+            {"format": "json", "draw": 2},
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_key_depends_on_language_and_time_zone(self):
+        etags = set()
+        for language, tz in [("en", "UTC"), ("sv", "UTC"), ("en", "Europe/Oslo")]:
+            with translation.override(language), timezone.override(tz):
+                response = get_response(CachedPersonTable, {"format": "json"})
+                etags.add(response["ETag"])
+        self.assertEqual(len(etags), 3)
+
+    def test_saving_changes_etag(self):
+        etag = get_response(CachedPersonTable, {"format": "json"})["ETag"]
+        Person.objects.first().save()
+        self.assertNotEqual(
+            get_response(CachedPersonTable, {"format": "json"})["ETag"], etag
+        )
+
+
+class FilterChoicesCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_related_models_are_watched_by_the_view(self):
+        self.assertEqual(PersonTable.get_filter_models(), [Job])
+        version = get_model_version(Job)
+        Job.objects.create(name="Job")
+        self.assertNotEqual(get_model_version(Job), version)
+
+    def test_saving_related_object_refreshes_choices(self):
+        job = Job.objects.create(name="Before")
+
+        class ChoicesPersonTable(PersonTable):
+            filter_cache_timeout = 60
+
+        def choices():
+            view = ChoicesPersonTable()
+            view.setup(RequestFactory().get("/"))
+            spec = view.init_datatable(view.request).get_filter_spec("job", [])
+            return [label for _, label in spec.lookup_choices]
+
+        self.assertEqual(choices(), ["Before"])
+        job.name = "After"
+        job.save()
+        self.assertEqual(choices(), ["After"])
+
+
+class LazyFilterSpecTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(4)
+
+    def get_job_queries(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = get_response(PersonTable, params)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elif hasattr(response, "render"):
+                response.render()
+        return [q["sql"] for q in queries if 'FROM "example_job"' in q["sql"]]
+
+    def test_json_and_csv_skip_filter_choices(self):
+        self.assertEqual(self.get_job_queries({"format": "json"}), [])
+        self.assertEqual(
+            self.get_job_queries({"format": "csv", "visible[]": ["last_name"]}), []
+        )
+
+    def test_page_loads_filter_choices(self):
+        self.assertNotEqual(self.get_job_queries({}), [])
+
+
+class ThreadBackend:
+    """Run jobs on another thread, like the pool, and wait for them."""
+
+    def submit(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.start()
+        thread.join()
+
+
+class ExportStorage(FileSystemStorage):
+    def __init__(self):
+        super().__init__(location=EXPORT_DIR)
+
+
+class ExportJobPersonTable(PersonTable):
+    columns = ["last_name", "updated"]
+    async_export = True
+    export_backend = ThreadBackend()
+    export_storage = "datatables.tests.ExportStorage"
+
+    def get_queryset(self):
+        return Person.objects.annotate(
+            updated=Value(UPDATED, output_field=DateTimeField())
+        )
+
+
+class BrokenExportJobPersonTable(ExportJobPersonTable):
+    def get_export(self, export_format="csv", queryset=None):
+        raise RuntimeError("secret details")
+
+
+class ExportJobTests(TransactionTestCase):
+    # The job reads the rows on another thread
+    params = {"format": "csv", "visible[]": ["last_name", "updated"]}
+
+    def setUp(self):
+        create_persons(2)
+
+    def tearDown(self):
+        shutil.rmtree(EXPORT_DIR, ignore_errors=True)
+
+    def read_streaming(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_job_uses_time_zone_and_language_of_request(self):
+        with timezone.override("Europe/Oslo"), translation.override("sv"):
+            expected = self.read_streaming(
+                get_response(ExportJobPersonTable, self.params)
+            )
+            job = json.loads(
+                get_response(
+                    ExportJobPersonTable, {**self.params, "export": "async"}
+                ).content
+            )
+        status = json.loads(
+            get_response(ExportJobPersonTable, {"export_job": job["id"]}).content
+        )
+        self.assertEqual(status["status"], "done")
+        response = get_response(
+            ExportJobPersonTable, {"export_job": job["id"], "download": 1}
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(content, expected)
+        self.assertIn("2024-05-06 09:08", content)
+
+    def test_failed_job_hides_error(self):
+        with self.assertLogs("datatables.jobs", "ERROR"):
+            job = json.loads(
+                get_response(
+                    BrokenExportJobPersonTable, {**self.params, "export": "async"}
+                ).content
+            )
+        status = json.loads(
+            get_response(BrokenExportJobPersonTable, {"export_job": job["id"]}).content
+        )
+        self.assertEqual(status["status"], "failed")
+        self.assertNotIn("secret", status["error"])
+
+    def test_delete_expired_exports(self):
+        job = json.loads(
+            get_response(
+                ExportJobPersonTable, {**self.params, "export": "async"}
+            ).content
+        )
+        storage = ExportStorage()
+        name = get_job(job["id"])["file"]
+        options = {"storage": "datatables.tests.ExportStorage", "verbosity": 0}
+        call_command("datatables_delete_exports", **options)
+        self.assertTrue(storage.exists(name))
+        call_command("datatables_delete_exports", max_age=0, **options)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(f"datatables/exports/{job['id']}"))
+
+
+class ChunkedExportTests(TestCase):
+    params = {
+        "format": "csv",
+        "visible[]": ["first_name", "last_name", "date_of_birth", "job"],
+        "order[0][column]": 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(25)
+
+    def export(self, params=None, **attrs):
+        view_class = type("View", (PersonTable,), attrs)
+        response = get_response(view_class, {**self.params, **(params or {})})
+        return list(response.streaming_content)
+
+    def test_chunks_give_same_bytes(self):
+        chunks = self.export(export_chunk_size=3, export_buffer_size=10)
+        expected = self.export(export_chunk_size=100, export_buffer_size=10**6)
+        self.assertGreater(len(chunks), len(expected))
+        self.assertEqual(b"".join(chunks), b"".join(expected))
+        self.assertEqual(len(b"".join(chunks).decode().splitlines()), 26)
+
+    def test_gzip_chunks_give_same_bytes(self):
+        chunks = self.export(
+            {"compress": "gzip"}, export_chunk_size=3, export_buffer_size=10
+        )
+        expected = self.export(export_chunk_size=100, export_buffer_size=10**6)
+        self.assertEqual(gzip.decompress(b"".join(chunks)), b"".join(expected))
+
+
+class TypedExportPersonTable(PersonTable):
+    columns = ["last_name", "pk", "date_of_birth", "job__name"]
+    export_formats = ["csv", "ndjson", "parquet"]
+
+
+class ViewMethodTypedExportPersonTable(TypedExportPersonTable):
+    def pk(self, obj):
+        return f"#{obj.pk}"
+
+
+class TypedExportTests(TestCase):
+    params = {"visible[]": ["last_name", "pk", "date_of_birth", "job__name"]}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.persons = create_persons(4)
+
+    def export(self, view_class, export_format):
+        response = get_response(view_class, {**self.params, "format": export_format})
+        return b"".join(response.streaming_content)
+
+    def test_ndjson_keeps_types(self):
+        rows = {
+            row["pk"]: row
+            for row in map(
+                json.loads, self.export(TypedExportPersonTable, "ndjson").splitlines()
+            )
+        }
+        person = self.persons[3]
+        self.assertEqual(
+            rows[person.pk],
+            {
+                "last_name": person.last_name,
+                "pk": person.pk,
+                "date_of_birth": person.date_of_birth.isoformat(),
+                "job__name": "",
+            },
+        )
+
+    @skipUnless(pa, "pyarrow is not installed")
+    def test_parquet_view_method_is_text(self):
+        content = self.export(ViewMethodTypedExportPersonTable, "parquet")
+        table = pq.read_table(pa.BufferReader(content))
+        self.assertEqual(table.schema.field("pk").type, pa.string())
+        self.assertEqual(
+            sorted(table.column("pk").to_pylist()),
+            sorted(f"#{person.pk}" for person in self.persons),
+        )
+        self.assertEqual(table.schema.field("date_of_birth").type, pa.date32())
+
+
+class XlsxPersonTable(TypedExportPersonTable):
+    export_formats = ["xlsx"]
+
+
+@skipUnless(xlsxwriter, "xlsxwriter is not installed")
+class XlsxExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.persons = create_persons(4)
+
+    def read_rows(self, content):
+        """Return the cell values of the rows of the first worksheet."""
+        ns = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            sheet = ElementTree.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+        rows = []
+        for row in sheet.iterfind("x:sheetData/x:row", ns):
+            values = {}
+            for cell in row.iterfind("x:c", ns):
+                column = cell.get("r").rstrip("0123456789")
+                if cell.get("t") == "inlineStr":
+                    values[column] = cell.findtext("x:is/x:t", namespaces=ns)
+                else:
+                    values[column] = float(cell.findtext("x:v", namespaces=ns))
+            rows.append([values.get(column) for column in "ABCD"])
+        return rows
+
+    def test_xlsx_keeps_types(self):
+        params = {**TypedExportTests.params, "format": "xlsx"}
+        response = get_response(XlsxPersonTable, params)
+        self.assertEqual(response["Content-Type"], EXPORT_FORMATS["xlsx"].content_type)
+        header, *rows = self.read_rows(b"".join(response.streaming_content))
+        self.assertEqual(header, ["last_name", "pk", "date_of_birth", "job__name"])
+        excel_epoch = date(1899, 12, 30)
+        self.assertEqual(
+            sorted(rows, key=lambda row: row[1]),
+            [
+                [
+                    person.last_name,
+                    person.pk,
+                    (person.date_of_birth - excel_epoch).days,
+                    person.job.name if person.job else None,
+                ]
+                for person in self.persons
+            ],
+        )
+
+    def test_missing_requirement_is_improperly_configured(self):
+        with patch.dict(EXPORT_FORMATS):
+            del EXPORT_FORMATS["xlsx"]
+            with self.assertRaisesMessage(
+                ImproperlyConfigured, "django-datatablesview[xlsx]"
+            ):
+                get_response(XlsxPersonTable, {"format": "xlsx"})
+
+    def test_unknown_format_is_improperly_configured(self):
+        view_class = type("View", (PersonTable,), {"export_formats": ["xls"]})
+        with self.assertRaisesMessage(ImproperlyConfigured, "'xls'"):
+            get_response(view_class, {"format": "xls"})
+
+
+class ColumnSearchPersonTable(PersonTable):
+    column_search = {"last_name": "istartswith"}
+
+
+class SearchBoxPersonTable(PersonTable):
+    table_search_fields = ["last_name"]
+    column_search = {
+        "last_name": "istartswith",
+        "date_of_birth": "range",
+        "education": "exact",
+    }
+
+
+class ColumnSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(7)
+
+    def get_first_names(self, params):
+        result = get_json(SearchBoxPersonTable, {"length": 10, **params})
+        return sorted(strip_tags(row["first_name"]) for row in result["data"])
+
+    def test_table_search_uses_table_search_fields(self):
+        self.assertEqual(self.get_first_names({"search[value]": "First"}), [])
+        self.assertEqual(
+            self.get_first_names({"search[value]": "Last 1"}), ["First 1", "First 5"]
+        )
+        self.assertEqual(
+            self.get_first_names({"main_search": "First"}),
+            [f"First {i}" for i in range(7)],
+        )
+
+    def test_istartswith(self):
+        self.assertEqual(
+            self.get_first_names({"columns[1][search][value]": "last 2"}),
+            ["First 2", "First 6"],
+        )
+        self.assertEqual(self.get_first_names({"columns[1][search][value]": "2"}), [])
+
+    def test_exact(self):
+        self.assertEqual(
+            self.get_first_names({"columns[5][search][value]": "Bachelor"}),
+            ["First 1", "First 2", "First 4", "First 5"],
+        )
+
+    def test_range(self):
+        column = "columns[2][search][value]"
+        self.assertEqual(
+            self.get_first_names({column: "1990-01-02, 1990-01-04"}),
+            ["First 1", "First 2", "First 3"],
+        )
+        self.assertEqual(
+            self.get_first_names({column: "1990-01-06,"}), ["First 5", "First 6"]
+        )
+        self.assertEqual(self.get_first_names({column: ",1990-01-01"}), ["First 0"])
+
+    def test_invalid_value_matches_nothing(self):
+        result = get_json(
+            SearchBoxPersonTable, {"columns[2][search][value]": "not a date,"}
+        )
+        self.assertEqual(result["data"], [])
+        self.assertEqual(result["recordsFiltered"], 0)
+
+
+class TableTemplateTests(TestCase):
+    def get_datatable(self, view_class):
+        view = view_class()
+        view.setup(RequestFactory().get("/"))
+        return view.init_datatable(view.request)
+
+    def test_table_columns_keep_five_values(self):
+        datatable = self.get_datatable(ColumnSearchPersonTable)
+        for column in datatable.get_table_columns():
+            self.assertEqual(len(column), 5)
+
+    def test_column_search_inputs(self):
+        datatable = self.get_datatable(ColumnSearchPersonTable)
+        html = datatable.table()
+        self.assertEqual(html.count("form-control column-search"), 1)
+        self.assertIn('placeholder="Last name"', html)
+
+
+class LastNameSearchDatatable(Datatable):
+    def parse_search(self):
+        return Q(last_name=self.request.GET.get("search[value]"))
+
+
+class LastNameSearchPersonTable(PersonTable):
+    datatable_class = LastNameSearchDatatable
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(8)
+
+    def test_search_backend(self):
+        result = get_json(
+            PersonTable, {"length": 10, "search[value]": '"first 1" last'}
+        )
+        self.assertEqual(result["recordsFiltered"], 1)
+
+    def test_overridden_parse_search(self):
+        with self.assertWarns(DeprecationWarning):
+            result = get_json(
+                LastNameSearchPersonTable, {"length": 10, "search[value]": "Last 1"}
+            )
+        self.assertEqual(result["recordsFiltered"], 2)
+
+
+def count_json_queries(view_class, params):
+    with CaptureQueriesContext(connection) as queries:
+        result = get_json(view_class, params)
+    return result, len(queries)
+
+
+class JobCountPersonTable(PersonTable):
+    columns = PersonTable.columns + ["job_persons"]
+
+    def job_persons(self, obj):
+        return Person.objects.filter(job_id=obj.job_id).count()
+
+
+class ConstantQueriesTests(TestCase):
+    def test_passes(self):
+        assert_constant_queries(PersonTable, create_persons)
+
+    def test_fails_on_view_method_query(self):
+        with self.assertRaises(AssertionError) as cm:
+            assert_constant_queries(JobCountPersonTable, create_persons)
+        # Reported for the JSON and the CSV response
+        self.assertEqual(str(cm.exception).count("grow: 'job_persons' ("), 2)
+
+
+class ValuesPersonTable(PersonTable):
+    columns = ["last_name", "education", "job__name", "date_of_birth", "pk"]
+
+
+class InstancesDatatable(Datatable):
+    def get_values_plan(self, columns, qs, raw=False, typed=False):
+        return None
+
+
+class InstancesPersonTable(ValuesPersonTable):
+    datatable_class = InstancesDatatable
+
+
+class ValuesListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(6)
+
+    def test_values_match_instances(self):
+        params = {"length": 10, "order[0][column]": 2}
+        values, queries = count_json_queries(ValuesPersonTable, params)
+        self.assertEqual(values, get_json(InstancesPersonTable, params))
+        self.assertEqual(queries, 3)  # Total, filtered count and the page
+        self.assertIn(
+            {"job__name": "", "education": "-"}.items(),
+            [
+                {k: row[k] for k in ("job__name", "education")}.items()
+                for row in values["data"]
+            ],
+        )
+
+
+class ProjectionPersonTable(PersonTable):
+    columns = ["last_name", "job__name"]
+
+
+class ProjectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(4)
+
+    def get_datatable(self, view_class, **attrs):
+        view = type("View", (view_class,), attrs)()
+        view.setup(RequestFactory().get("/"))
+        return view.init_datatable(view.request)
+
+    def get_rows(self, datatable):
+        qs = datatable.filter_queryset(datatable.view.get_queryset())
+        return list(datatable.get_rows_queryset(qs, datatable.columns)[0])
+
+    def test_only_loads_shown_fields(self):
+        datatable = self.get_datatable(InstancesPersonTable)
+        qs = Person.objects.all()
+        self.assertEqual(
+            datatable.get_only_fields(datatable.columns, qs),
+            ["last_name", "education", "job__name", "date_of_birth"],
+        )
+        for person in self.get_rows(datatable):
+            self.assertEqual(person.get_deferred_fields(), {"first_name"})
+            if person.job_id is not None:
+                self.assertEqual(person.job.get_deferred_fields(), set())
+
+    def test_column_fields_of_view_methods(self):
+        datatable = self.get_datatable(PersonTable)
+        self.assertEqual(
+            datatable.get_only_fields(datatable.columns, Person.objects.all()),
+            ["first_name", "last_name", "date_of_birth", "education", "job"],
+        )
+        with self.assertNumQueries(1):
+            for person in self.get_rows(datatable):
+                self.assertEqual(person.get_deferred_fields(), set())
+                str(person.job)
+
+    def test_select_related_is_not_deferred(self):
+        datatable = self.get_datatable(
+            ProjectionPersonTable,
+            datatable_class=InstancesDatatable,
+            columns=["last_name"],
+            select_related=["job"],
+            prefetch_related=[],
+        )
+        self.assertEqual(
+            datatable.get_only_fields(datatable.columns, Person.objects.all()),
+            ["last_name", "job"],
+        )
+        with self.assertNumQueries(1):
+            for person in self.get_rows(datatable):
+                str(person.job)
+
+    def test_undeclared_view_method_loads_every_field(self):
+        datatable = self.get_datatable(
+            ProjectionPersonTable,
+            columns=["last_name", "initials"],
+            initials=lambda self, obj: obj.first_name[0],
+        )
+        self.assertIsNone(
+            datatable.get_only_fields(datatable.columns, Person.objects.all())
+        )
+        for person in self.get_rows(datatable):
+            self.assertEqual(person.get_deferred_fields(), set())
+
+
+class DeltaPersonTable(PersonTable):
+    change_tracking_field = "date_of_birth"
+    paginate_by = 3
+
+
+class DeltaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.persons = create_persons(6)
+
+    def test_only_changed_rows_are_sent(self):
+        params = {"length": 3, "order[0][column]": 6}
+        first = get_json(DeltaPersonTable, params)
+        self.assertFalse(first["delta"])
+        self.assertEqual(len(first["data"]), 3)
+
+        unchanged = get_json(DeltaPersonTable, {**params, "since": first["since"]})
+        self.assertTrue(unchanged["delta"])
+        self.assertEqual(unchanged["data"], [])
+
+        person = self.persons[1]
+        person.date_of_birth = date(2020, 1, 1)
+        person.save()
+        changed = get_json(DeltaPersonTable, {**params, "since": first["since"]})
+        self.assertTrue(changed["delta"])
+        self.assertEqual([row["DT_RowId"] for row in changed["data"]], [person.pk])
+
+    def test_other_rows_send_page(self):
+        params = {"length": 3, "order[0][column]": 6}
+        first = get_json(DeltaPersonTable, params)
+        self.persons[0].delete()
+        result = get_json(DeltaPersonTable, {**params, "since": first["since"]})
+        self.assertFalse(result["delta"])
+        self.assertEqual(len(result["data"]), 3)
+
+
+class DeltaUserTable(DatatableView):
+    model = User
+    columns = ["username", "date_joined"]
+    change_tracking_field = "date_joined"
+
+
+class DateTimeDeltaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_users(4)
+
+    def test_unchanged_page_is_empty_delta(self):
+        first = get_json(DeltaUserTable, {"length": 10})
+        result = get_json(DeltaUserTable, {"length": 10, "since": first["since"]})
+        self.assertTrue(result["delta"])
+        self.assertEqual(result["data"], [])
+
+        user = self.users[0]
+        user.date_joined += timedelta(microseconds=10)
+        user.save()
+        result = get_json(DeltaUserTable, {"length": 10, "since": first["since"]})
+        self.assertEqual([row["DT_RowId"] for row in result["data"]], [user.pk])
+
+    def test_invalid_version_sends_page(self):
+        first = get_json(DeltaUserTable, {"length": 10})
+        payload = json.loads(base64.urlsafe_b64decode(first["since"]))
+        since = encode_since(
+            [user.pk for user in self.users], payload["v"].replace("2024", "x")
+        )
+        self.assertEqual(payload["p"], json.loads(base64.urlsafe_b64decode(since))["p"])
+        result = get_json(DeltaUserTable, {"length": 10, "since": since})
+        self.assertFalse(result["delta"])
+        self.assertEqual(len(result["data"]), 4)
+
+
+class LivePersonTable(PersonTable):
+    live_updates = True
+
+
+class EventsTests(TestCase):
+    def test_broker_keeps_one_message(self):
+        async def run():
+            queue = broker.subscribe(["example.person"])
+            thread = threading.Thread(
+                target=lambda: [
+                    broker.publish("example.person", {"n": n}) for n in range(3)
+                ]
+            )
+            thread.start()
+            thread.join()
+            await asyncio.sleep(0)
+            messages = [await queue.get()]
+            broker.unsubscribe(["example.person"], queue)
+            broker.publish("example.person", {"n": 3})
+            await asyncio.sleep(0)
+            return messages, queue.qsize()
+
+        messages, size = async_to_sync(run)()
+        self.assertEqual(messages, [{"n": 0}])
+        self.assertEqual(size, 0)
+        self.assertNotIn("example.person", broker.subscribers)
+
+    def test_event_stream(self):
+        async def run():
+            stream = event_stream([Person], heartbeat=0.01, retry=1000)
+            events = [await anext(stream), await anext(stream)]
+            # Saves in this process are published by the signals
+            await sync_to_async(create_persons)(1)
+            events.append(await anext(stream))
+            # Saves in other processes only change the version in the cache
+            await cache.aset(VERSION_KEY.format("example.person"), 0, None)
+            events.append(await anext(stream))
+            await stream.aclose()
+            return events
+
+        self.assertEqual(
+            async_to_sync(run)(),
+            [
+                "retry: 1000\n\n",
+                ": heartbeat\n\n",
+                'event: change\ndata: {"model": "example.person"}\n\n',
+                "event: change\ndata: {}\n\n",
+            ],
+        )
+        self.assertNotIn("example.person", broker.subscribers)
+
+    def test_wsgi_stops_reconnects(self):
+        response = get_response(LivePersonTable, {"format": "events"})
+        self.assertEqual(response.status_code, 204)
+
+
+class DatetimeUserTable(DatatableView):
+    model = User
+    columns = [
+        "username",
+        ("date_joined", "Joined", {"naturaltime": True}),
+        "last_login",
+    ]
+
+
+class DatetimeFormatTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(username="u", date_joined=UPDATED, last_login=UPDATED)
+
+    def get_row(self, datetime_format):
+        view_class = type(
+            "View", (DatetimeUserTable,), {"datetime_format": datetime_format}
+        )
+        with timezone.override("Europe/Oslo"):
+            [row] = get_json(view_class, {})["data"]
+        return row["date_joined"], row["last_login"]
+
+    def test_text(self):
+        joined, last_login = self.get_row("text")
+        self.assertEqual(last_login, "2024-05-06 09:08")
+        self.assertRegex(joined, r"^2024-05-06 09:08 \(.+ ago\)$")
+
+    def test_iso(self):
+        self.assertEqual(
+            self.get_row("iso"),
+            ("2024-05-06T09:08:00+02:00", "2024-05-06T09:08:00+02:00"),
+        )
+
+    def test_epoch(self):
+        epoch = round(UPDATED.timestamp() * 1000)
+        self.assertEqual(self.get_row("epoch"), (epoch, epoch))
+
+    def test_default_keeps_naturaltime_everywhere(self):
+        for value in self.get_row(None):
+            self.assertRegex(value, r"^2024-05-06 09:08 \(.+ ago\)$")
+
+    def test_datetime_columns_attribute(self):
+        view_class = type("View", (DatetimeUserTable,), {"datetime_format": "iso"})
+        view = view_class()
+        view.setup(RequestFactory().get("/"))
+        with timezone.override("Europe/Oslo"):
+            html = view.init_datatable(view.request).table()
+        columns = {"date_joined": "relative", "last_login": "local"}
+        self.assertIn(f'data-datetime-columns="{escape(json.dumps(columns))}"', html)
+        self.assertIn('data-timezone="Europe/Oslo"', html)
+
+        view = DatetimeUserTable()
+        view.setup(RequestFactory().get("/"))
+        self.assertNotIn(
+            "data-datetime-columns", view.init_datatable(view.request).table()
+        )
+
+
+class CountCachePersonTable(PersonTable):
+    count_cache_timeout = 60
+
+
+class FacetPersonTable(PersonTable):
+    facets = True
+
+
+class QueryCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(4)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_total_count_is_cached_until_save(self):
+        result, queries = count_json_queries(CountCachePersonTable, {})
+        self.assertEqual(result["recordsTotal"], 4)
+        result, cached_queries = count_json_queries(CountCachePersonTable, {})
+        self.assertEqual(cached_queries, queries - 1)
+
+        create_persons(1, start=4)
+        result, queries = count_json_queries(CountCachePersonTable, {})
+        self.assertEqual(result["recordsTotal"], 5)
+
+    def test_facets_are_cached(self):
+        result, queries = count_json_queries(FacetPersonTable, {})
+        self.assertEqual(
+            result["facets"]["education__in"], {"education__in=Bachelor": 2}
+        )
+        self.assertEqual(
+            result["facets"]["job__id__in"],
+            {f"job__id__in={job.pk}": 1 for job in Job.objects.all()},
+        )
+        _, cached_queries = count_json_queries(FacetPersonTable, {})
+        self.assertLess(cached_queries, queries)
+
+
+class TenfoldCount(ExactCount):
+    """An estimate that is always off, to tell it from an exact count."""
+
+    def count(self, qs):
+        return qs.count() * 10, True
+
+
+class CountStrategyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(5)
+
+    def count(self, strategy, qs=None):
+        with CaptureQueriesContext(connection) as queries:
+            result = strategy.count(Person.objects.all() if qs is None else qs)
+        return result, len(queries)
+
+    def test_estimates_are_exact_on_sqlite(self):
+        filtered = Person.objects.filter(education="Bachelor")
+        for strategy in (ReltuplesCount(), EstimatedCount()):
+            self.assertEqual(self.count(strategy), ((5, False), 1))
+            self.assertEqual(self.count(strategy, filtered), ((3, False), 1))
+
+    def test_threshold_count(self):
+        self.assertEqual(self.count(ThresholdCount(limit=5)), ((5, False), 1))
+        # Above the limit the estimate, an exact count on SQLite, is used
+        self.assertEqual(self.count(ThresholdCount(limit=4)), ((5, False), 2))
+        strategy = ThresholdCount(limit=4, estimate=TenfoldCount())
+        self.assertEqual(self.count(strategy), ((50, True), 2))
+
+    def test_approximate_counts_in_response(self):
+        class EstimatedPersonTable(PersonTable):
+            count_strategy = ThresholdCount(limit=4, estimate=TenfoldCount())
+
+        result = get_json(EstimatedPersonTable, {})
+        self.assertEqual(result["recordsTotal"], 50)
+        self.assertTrue(result["recordsTotalApproximate"])
+        self.assertEqual(result["recordsFiltered"], 50)
+        self.assertTrue(result["recordsFilteredApproximate"])
+
+        result = get_json(EstimatedPersonTable, {"filters[]": "education__in=Bachelor"})
+        self.assertEqual(result["recordsFiltered"], 3)
+        self.assertFalse(result["recordsFilteredApproximate"])
+
+        result = get_json(PersonTable, {})
+        self.assertEqual(result["recordsTotal"], 5)
+        self.assertFalse(result["recordsTotalApproximate"])
+
+
+class FtsPersonTable(PersonTable):
+    search_backend = SqliteFtsSearch()
+
+
+@skipUnless(connection.vendor == "sqlite", "FTS5 is an SQLite feature")
+class SqliteFtsSearchTests(TransactionTestCase):
+    # Virtual tables can't be created in the transaction of a TestCase
+    def setUp(self):
+        create_persons(8)
+        with connection.cursor() as cursor:
+            for sql in SqliteFtsSearch().create_sql(
+                Person, ["first_name", "last_name", "job__name"]
+            ):
+                cursor.execute(sql)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for trigger in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER example_person_fts_{trigger}")
+            cursor.execute("DROP TABLE example_person_fts")
+
+    def filter(self, search):
+        backend = SqliteFtsSearch()
+        qs = backend.filter(Person.objects.all(), ["first_name", "last_name"], search)
+        return sorted(qs.values_list("first_name", flat=True))
+
+    def test_terms_narrow_results(self):
+        self.assertEqual(len(self.filter("last")), 8)
+        self.assertEqual(self.filter("last 1"), ["First 1", "First 5"])
+        self.assertEqual(self.filter("fir 5 las"), ["First 5"])
+        self.assertEqual(self.filter("first 5 last 2"), [])
+        self.assertEqual(self.filter('"quoted'), [])
+
+    def test_triggers_keep_index_in_sync(self):
+        person = Person.objects.get(first_name="First 5")
+        person.last_name = "Renamed"
+        person.save()
+        self.assertEqual(self.filter("renamed"), ["First 5"])
+        self.assertEqual(self.filter("last 1"), ["First 1"])
+        create_persons(1, start=9)
+        self.assertEqual(self.filter("first 9"), ["First 9"])
+
+    def test_view_search(self):
+        result = get_json(FtsPersonTable, {"length": 10, "search[value]": "Last 3"})
+        self.assertEqual(result["recordsFiltered"], 2)
+
+
+class RecordingExecutor(QueryExecutor):
+    """QueryExecutor that records the phase or name of each submitted call."""
+
+    def __init__(self):
+        super().__init__(max_workers=4)
+        self.calls = []
+
+    def submit(self, func, *args):
+        name = func.__name__
+        self.calls.append(args[0] if name == "call_timed" else name)
+        return super().submit(func, *args)
+
+
+class ConcurrentDatatable(Datatable):
+    def is_concurrent(self, qs):
+        # The test database is an in-memory SQLite database whose shared
+        # cache lets the pool threads see committed rows.
+        return self.query_executor is not None
+
+
+class ConcurrentPersonTable(PersonTable):
+    datatable_class = ConcurrentDatatable
+    concurrent_queries = True
+    facets = True
+
+
+class ConcurrentQueriesTests(TransactionTestCase):
+    def setUp(self):
+        create_persons(7)
+        ConcurrentPersonTable.query_executor = RecordingExecutor()
+
+    def test_concurrent_result_matches_sequential(self):
+        class SequentialPersonTable(PersonTable):
+            facets = True
+
+        params = {"length": 3, "filters[]": "education__in=Bachelor"}
+        result = get_json(ConcurrentPersonTable, params)
+        self.assertEqual(result, get_json(SequentialPersonTable, params))
+        self.assertEqual(
+            sorted(ConcurrentPersonTable.query_executor.calls),
+            ["count_filtered", "count_total", "facets", "serialize_page"],
+        )
+
+    def test_export_does_not_count(self):
+        params = {"format": "csv", "visible[]": ["last_name"]}
+        with CaptureQueriesContext(connection) as queries:
+            response = get_response(ConcurrentPersonTable, params)
+            rows = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(ConcurrentPersonTable.query_executor.calls, [])
+        self.assertFalse(any("COUNT" in q["sql"] for q in queries.captured_queries))
+
+    def test_can_run_concurrently(self):
+        with transaction.atomic():
+            self.assertFalse(can_run_concurrently("default"))
+        self.assertEqual(
+            can_run_concurrently("default"), not connection.is_in_memory_db()
+        )
+
+
+class TimedPersonTable(PersonTable):
+    timing = True
+
+
+class AsyncTimedPersonTable(AsyncDatatableView, TimedPersonTable):
+    pass
+
+
+class TimingTests(TestCase):
+    params = {"format": "json", "length": 3, "search[value]": "Last"}
+
+    @classmethod
+    def setUpTestData(cls):
+        create_persons(5)
+
+    def setUp(self):
+        self.records = []
+        request_timed.connect(self.receive)
+        self.addCleanup(request_timed.disconnect, self.receive)
+
+    def receive(self, sender, view, record, **kwargs):
+        self.records.append((sender, type(view), record))
+
+    def test_record_and_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = get_response(TimedPersonTable, self.params)
+
+        [(sender, view_class, record)] = self.records
+        self.assertEqual((sender, view_class), (TimedPersonTable, TimedPersonTable))
+        self.assertEqual(record["view"], "datatables.tests.TimedPersonTable")
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["rows"], 3)
+        self.assertEqual(
+            {name: phase["queries"] for name, phase in record["phases"].items()},
+            {
+                "filter": 0,
+                "count_total": 1,
+                "count_filtered": 1,
+                "page": 1,
+                "serialize": 0,
+                "encode": 0,
+            },
+        )
+        self.assertEqual(record["queries"], len(queries.captured_queries))
+
+        metrics = dict(
+            metric.split(";", 1) for metric in response["Server-Timing"].split(", ")
+        )
+        self.assertEqual(set(metrics), {*record["phases"], "datatable"})
+        self.assertIn('desc="queries=1"', metrics["page"])
+        self.assertEqual(metrics["datatable"], f"dur={record['duration']:.3f}")
+
+    def test_async_view_does_not_count_queries(self):
+        response = get_response(AsyncTimedPersonTable, self.params)
+        [(_, _, record)] = self.records
+        self.assertIsNone(record["queries"])
+        self.assertEqual(record["rows"], 3)
+        self.assertNotIn("queries=", response["Server-Timing"])
+
+    def test_exports_are_not_timed(self):
+        response = get_response(TimedPersonTable, {**self.params, "format": "csv"})
+        b"".join(response.streaming_content)
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.records, [])
@@ -0,0 +1,84 @@
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+
+class Timing:
+    """Collect the time spent and the queries run in each phase of a request.
+
+    Queries are counted with execute wrappers on the connections of the
+    thread a phase runs in. Phases of the same name are added up, phases that
+    run at the same time on several threads overlap.
+    """
+
+    def __init__(self, count_queries=True):
+        self.count_queries = count_queries
+        self.started = time.perf_counter()
+        self.duration = None
+        self.phases = {}
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            if self.count_queries:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(count))
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add(name, time.perf_counter() - started, queries[0])
+
+    def add(self, name, duration, queries=0):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"duration": 0, "queries": 0})
+            phase["duration"] += duration * 1000
+            phase["queries"] += queries
+
+    def add_rows(self, rows):
+        with self.lock:
+            self.rows += rows
+
+    def stop(self):
+        self.duration = (time.perf_counter() - self.started) * 1000
+
+    def get_record(self, **extra):
+        """Return the timings in milliseconds as a dict."""
+        queries = None
+        phases = {
+            name: {
+                "duration": round(phase["duration"], 3),
+                "queries": phase["queries"] if self.count_queries else None,
+            }
+            for name, phase in self.phases.items()
+        }
+        if self.count_queries:
+            queries = sum(phase["queries"] for phase in self.phases.values())
+        return {
+            "duration": round(self.duration, 3),
+            "phases": phases,
+            "queries": queries,
+            "rows": self.rows,
+            **extra,
+        }
+
+    def get_server_timing(self):
+        """Return the value of a Server-Timing header for the timings."""
+        metrics = []
+        for name, phase in self.phases.items():
+            metric = f"{name};dur={phase['duration']:.3f}"
+            if self.count_queries:
+                metric += f';desc="queries={phase["queries"]}"'
+            metrics.append(metric)
+        metrics.append(f"datatable;dur={self.duration:.3f}")
+        return ", ".join(metrics)
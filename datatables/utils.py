@@ -1,5 +1,6 @@
 from datetime import (
     datetime,
+    time,
     timedelta,
 )
 from django.contrib.humanize.templatetags.humanize import naturaltime
@@ -9,6 +10,19 @@ from django.contrib.admin.utils import FieldIsAForeignKeyColumnName
 from django.core.exceptions import (
     FieldDoesNotExist,
 )
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class ExactJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder that keeps the microseconds of datetimes and times.
+
+    Values decoded from it compare equal to the ones in the database.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime, time)):
+            return o.isoformat()
+        return super().default(o)
 
 
 class PassThroughWriter:
@@ -1,16 +1,41 @@
-import csv
+import hashlib
+import json
+import time
 from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.contrib.admin.utils import (
+    NotRelationField,
+    get_fields_from_path,
+    get_model_from_relation,
+)
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
 from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
     JsonResponse,
     StreamingHttpResponse,
 )
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
 from django.views.generic import TemplateView
-from .datatable import Datatable
-from .utils import PassThroughWriter
+from . import events
+from .cache import aget_model_version, get_model_version, watch_model
+from .concurrency import default_executor
+from .datatable import AsyncDatatable, Datatable
+from .exports import EXPORT_EXTRAS, EXPORT_FORMATS
+from .jobs import create_job, default_backend, get_job, get_storage
+from .signals import request_timed
+from .timing import Timing
 
 
 class DatatableView(TemplateView):
     template_name = "datatables/datatable.html"
+    datatable_class = Datatable
     model = None
     columns = None
     list_filters = None
@@ -21,16 +46,69 @@ class DatatableView(TemplateView):
     table_config = None
     lookup_opts = None
     filters = None
+    filter_cache_timeout = None  # Seconds to cache the choices of filters
+    facets = False
+    facet_cache_timeout = 10  # Seconds
     exportable = False
+    export_formats = ["csv"]
     update_interval = 60000  # Milliseconds
     paginate_by = 25
+    change_tracking_field = None  # e.g. "updated_at", enables delta updates
+    json_cache_timeout = None  # Seconds, enables ETags and cached responses
+    cache_models = None  # Other models whose changes show in the table
+    live_updates = False  # Push changes over server-sent events, needs ASGI
+    live_heartbeat = 15  # Seconds
+    keyset_pagination = False
+    count_cache_timeout = None  # Seconds
+    count_cache_serve_stale = False
+    count_strategy = None
+    countless_pagination = False
+    select_related = None
+    prefetch_related = None
+    column_fields = None
+    concurrent_queries = False  # Run the counts and the page at the same time
+    query_executor = None
+    timing = False  # Time the phases of JSON responses, see record_timing()
+    datetime_format = None  # "text", "iso" or "epoch", None adds naturaltime
+    search_backend = None
+    column_search = None  # Column name to lookup, e.g. {"name": "istartswith"}
+    export_chunk_size = 2000  # Rows fetched at a time
+    export_buffer_size = 64 * 1024  # Characters sent at a time
+    async_export = False
+    export_job_timeout = 24 * 60 * 60  # Seconds
+    export_backend = None
+    export_storage = None  # Import path of a storage class
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in [cls.model, *(cls.cache_models or [])]:
+            if model is not None:
+                watch_model(model)
+                events.watch_model(model)
+        for model in cls.get_filter_models():
+            # Cached filter choices are invalidated by saves in any process
+            watch_model(model)
+
+    @classmethod
+    def get_filter_models(cls):
+        """Return the related models whose objects are choices of list_filters."""
+        models = []
+        for list_filter, *_ in cls.list_filters or []:
+            if cls.model is None or not isinstance(list_filter, str):
+                continue
+            try:
+                field = get_fields_from_path(cls.model, list_filter)[-1]
+                models.append(get_model_from_relation(field))
+            except (FieldDoesNotExist, NotRelationField):
+                continue
+        return models
 
     def dispatch(self, request, *args, **kwargs):
         self.init_datatable(request, **kwargs)
         return super().dispatch(request, *args, **kwargs)
 
     def init_datatable(self, request, **kwargs):
-        self.datatable = Datatable(
+        self.datatable = self.datatable_class(
             request,
             self.model,
             self,
@@ -43,6 +121,22 @@ class DatatableView(TemplateView):
             self.get_table_search_fields(),
             self.get_table_config(**kwargs),
             self.get_paginate_by(),
+            keyset_pagination=self.get_keyset_pagination(),
+            count_cache_timeout=self.get_count_cache_timeout(),
+            count_cache_serve_stale=self.count_cache_serve_stale,
+            count_strategy=self.get_count_strategy(),
+            countless_pagination=self.get_countless_pagination(),
+            select_related=self.get_select_related(),
+            prefetch_related=self.get_prefetch_related(),
+            column_fields=self.get_column_fields(),
+            search_backend=self.get_search_backend(),
+            column_search=self.get_column_search(),
+            filter_cache_timeout=self.filter_cache_timeout,
+            facets=self.facets,
+            facet_cache_timeout=self.facet_cache_timeout,
+            change_tracking_field=self.change_tracking_field,
+            query_executor=self.get_query_executor(),
+            datetime_format=self.get_datetime_format(),
         )
         if self.lookup_opts:
             self.datatable.lookup_opts = self.lookup_opts
@@ -81,6 +175,44 @@ class DatatableView(TemplateView):
     def get_paginate_by(self):
         return self.paginate_by
 
+    def get_keyset_pagination(self):
+        return self.keyset_pagination
+
+    def get_count_cache_timeout(self):
+        return self.count_cache_timeout
+
+    def get_count_strategy(self):
+        return self.count_strategy
+
+    def get_countless_pagination(self):
+        return self.countless_pagination
+
+    def get_select_related(self):
+        """Return None to select the related objects used by the columns."""
+        return self.select_related
+
+    def get_prefetch_related(self):
+        """Return None to prefetch the related objects used by the columns."""
+        return self.prefetch_related
+
+    def get_column_fields(self):
+        return self.column_fields or {}
+
+    def get_query_executor(self):
+        """Return the executor of concurrent queries, or None to run them in turn."""
+        if not self.concurrent_queries:
+            return None
+        return self.query_executor or default_executor
+
+    def get_datetime_format(self):
+        return self.datetime_format
+
+    def get_search_backend(self):
+        return self.search_backend
+
+    def get_column_search(self):
+        return self.column_search or {}
+
     def get_queryset(self):
         qs = self.model.objects.all()
         return qs
@@ -92,44 +224,318 @@ class DatatableView(TemplateView):
         return context
 
     def render_to_json_response(self):
-        data = self.get_data()
-        return JsonResponse(self.datatable.serialize(data))
+        if not self.timing:
+            return self.get_json_response()
+        self.datatable.timing = self.get_timing()
+        return self.finish_timing(self.get_json_response())
+
+    def get_json_response(self):
+        if not self.json_cache_timeout:
+            data = self.get_data()
+            return self.encode_json(self.datatable.serialize(data))
+
+        etag, last_modified = self.get_json_validators()
+        response = get_conditional_response(
+            self.request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            key = f"datatables:json:{etag}"
+            content = cache.get(key)
+            if content is None:
+                data = self.get_data()
+                content = self.encode_json(self.datatable.serialize(data)).content
+                cache.set(key, content, self.json_cache_timeout)
+            response = HttpResponse(content, content_type="application/json")
+
+        return self.patch_json_response(response, etag, last_modified)
+
+    def encode_json(self, result):
+        with self.datatable.timed("encode"):
+            return JsonResponse(result)
+
+    def get_timing(self):
+        return Timing()
+
+    def finish_timing(self, response):
+        timing = self.datatable.timing
+        timing.stop()
+        response["Server-Timing"] = timing.get_server_timing()
+        view = type(self)
+        self.record_timing(
+            timing.get_record(
+                view=f"{view.__module__}.{view.__qualname__}",
+                status=response.status_code,
+            )
+        )
+        return response
+
+    def record_timing(self, record):
+        """Handle the timing record of a JSON response.
+
+        The record has the duration in milliseconds and the number of queries
+        of each phase, and the number of rows serialized. Sends the
+        request_timed signal.
+        """
+        request_timed.send(sender=type(self), view=self, record=record)
+
+    def patch_json_response(self, response, etag, last_modified):
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def render_event_stream(self):
+        """Stream a change event whenever the table's data may have changed.
+
+        Streaming a response indefinitely needs ASGI, under WSGI the client is
+        told to stop reconnecting and keeps polling.
+        """
+        if not isinstance(self.request, ASGIRequest):
+            return HttpResponse(status=204)
 
-    def download_as_csv(self):
-        def csv_row_generator(query_set):
-            writer = csv.writer(PassThroughWriter())
-            headers = [
-                c[1] if isinstance(c, tuple) else c for c in self.get_export_columns()
-            ]
-
-            yield writer.writerow(headers)
-
-            for obj in query_set:
-                row = [
-                    self.datatable.get_column_value(obj, c, raw=True)
-                    for c in self.get_export_columns()
-                ]
-                yield writer.writerow(row)
-
-        query_set = self.get_data()
         response = StreamingHttpResponse(
-            csv_row_generator(query_set), content_type="text/csv"
+            events.event_stream(self.get_cache_models(), self.live_heartbeat),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Don't let nginx buffer events
+        return response
+
+    def get_cache_models(self):
+        return [self.model, *(self.cache_models or [])]
+
+    def get_json_cache_key(self):
+        """Return a key for the table, user, language, time zone and request.
+
+        The request parameters are sorted, without draw and _ that change with
+        every request.
+        """
+        view = type(self)
+        user = getattr(self.request, "user", None)
+        params = sorted(
+            (key, self.request.GET.getlist(key))
+            for key in self.request.GET
+            if key not in ("draw", "_")
+        )
+        key = json.dumps(
+            [
+                f"{view.__module__}.{view.__qualname__}",
+                self.kwargs,
+                user.pk if user is not None and user.is_authenticated else None,
+                get_language(),
+                get_current_timezone_name(),
+                params,
+            ],
+            default=str,
+        )
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get_json_validators(self, versions=None):
+        """Return the ETag and last modified time of the JSON response.
+
+        Both change when one of the cache models is saved or deleted, and at
+        least every json_cache_timeout seconds.
+        """
+        if versions is None:
+            versions = [get_model_version(m) for m in self.get_cache_models()]
+        period = int(time.time() // self.json_cache_timeout)
+        last_modified = max(*versions, period * self.json_cache_timeout)
+        tag = f"{self.get_json_cache_key()}:{versions}:{period}"
+        return quote_etag(hashlib.md5(tag.encode()).hexdigest()), int(last_modified)
+
+    def get_export_formats(self):
+        for export_format in self.export_formats:
+            if export_format in EXPORT_FORMATS:
+                continue
+            if export_format in EXPORT_EXTRAS:
+                raise ImproperlyConfigured(
+                    f"The {export_format} export format needs "
+                    f"django-datatablesview[{EXPORT_EXTRAS[export_format]}]."
+                )
+            raise ImproperlyConfigured(f"Unknown export format {export_format!r}.")
+        return self.export_formats
+
+    def render_choices_response(self):
+        choices = self.datatable.filter_choices(
+            self.request.GET.get("filter"), self.request.GET.get("q", "")
+        )
+        if choices is None:
+            raise Http404("No such filter")
+        return JsonResponse({"results": choices})
+
+    def get_export(self, export_format="csv", queryset=None):
+        return EXPORT_FORMATS[export_format](
+            self.datatable,
+            self.get_data() if queryset is None else queryset,
+            self.get_export_columns(),
+            chunk_size=self.export_chunk_size,
+            buffer_size=self.export_buffer_size,
+            compress=self.request.GET.get("compress") == "gzip",
         )
+
+    def get_export_filename(self):
         filename = self.model._meta.verbose_name_plural + "_{:%Y-%m-%dT%H-%M}".format(
             datetime.now()
         )
-        filename = filename.replace(" ", "_")
-        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+        return filename.replace(" ", "_")
+
+    def download_export(self, export_format="csv"):
+        export = self.get_export(export_format)
+        return self.get_export_response(export, export.stream())
+
+    def get_export_response(self, export, streaming_content):
+        response = StreamingHttpResponse(
+            streaming_content, content_type=export.get_content_type()
+        )
+        filename = f"{self.get_export_filename()}.{export.get_extension()}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    def download_as_csv(self):
+        return self.download_export("csv")
+
+    def get_export_backend(self):
+        return self.export_backend or default_backend
+
+    def start_export_job(self, export_format="csv"):
+        job = create_job(
+            self,
+            export_format,
+            self.export_job_timeout,
+            self.export_storage,
+            self.get_export_backend(),
+        )
+        return JsonResponse(self.get_export_job_status(job))
+
+    def get_export_job_status(self, job):
+        status = {
+            "id": job["id"],
+            "status": job["status"],
+            "rowsDone": job["rows_done"],
+            "rowsTotal": job["rows_total"],
+            "error": job["error"],
+            "statusUrl": f"?export_job={job['id']}",
+            "downloadUrl": None,
+        }
+        if job["status"] == "done":
+            status["downloadUrl"] = f"?export_job={job['id']}&download=1"
+        return status
+
+    def export_job_response(self, job_id):
+        job = get_job(job_id)
+        view = type(self)
+        user = getattr(self.request, "user", None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        if (
+            job is None
+            or job["view"] != f"{view.__module__}.{view.__qualname__}"
+            or job["user"] != user_id
+        ):
+            raise Http404("No such export")
+
+        if not self.request.GET.get("download"):
+            return JsonResponse(self.get_export_job_status(job))
+        if job["status"] != "done":
+            raise Http404("The export isn't done")
+
+        storage = get_storage(job["storage"])
+        return FileResponse(
+            storage.open(job["file"], "rb"),
+            as_attachment=True,
+            filename=job["filename"],
+        )
+
     def get_data(self):
         return self.datatable.get_queryset()
 
     def get(self, request, *args, **kwargs):
-        if request.GET.get("format") == "json":
+        if request.GET.get("export_job") and self.async_export:
+            return self.export_job_response(request.GET["export_job"])
+        elif request.GET.get("format") == "json":
             return self.render_to_json_response()
-        elif request.GET.get("format") == "csv":
-            return self.download_as_csv()
+        elif request.GET.get("format") == "events" and self.live_updates:
+            return self.render_event_stream()
+        elif request.GET.get("format") == "choices":
+            return self.render_choices_response()
+        elif request.GET.get("format") in self.get_export_formats():
+            export_format = request.GET["format"]
+            if self.async_export and request.GET.get("export") == "async":
+                return self.start_export_job(export_format)
+            return self.download_export(export_format)
+        else:
+            context = self.get_context_data()
+            return self.render_to_response(context)
+
+
+class AsyncDatatableView(DatatableView):
+    """DatatableView for ASGI that runs the queries with the async ORM.
+
+    Rows of JSON responses and exports are counted, fetched and streamed with
+    the async ORM. Filter choices and export jobs are handled by the sync code
+    in a thread.
+    """
+
+    datatable_class = AsyncDatatable
+
+    async def aget_data(self):
+        return await self.datatable.aget_queryset()
+
+    def get_timing(self):
+        # Queries run on the async ORM's thread, where they can't be counted
+        return Timing(count_queries=False)
+
+    async def arender_to_json_response(self):
+        if not self.timing:
+            return await self.aget_json_response()
+        self.datatable.timing = self.get_timing()
+        return self.finish_timing(await self.aget_json_response())
+
+    async def aget_json_response(self):
+        if not self.json_cache_timeout:
+            data = await self.aget_data()
+            return self.encode_json(await self.datatable.aserialize(data))
+
+        versions = [await aget_model_version(m) for m in self.get_cache_models()]
+        etag, last_modified = self.get_json_validators(versions)
+        response = get_conditional_response(
+            self.request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            key = f"datatables:json:{etag}"
+            content = await cache.aget(key)
+            if content is None:
+                data = await self.aget_data()
+                result = await self.datatable.aserialize(data)
+                content = self.encode_json(result).content
+                await cache.aset(key, content, self.json_cache_timeout)
+            response = HttpResponse(content, content_type="application/json")
+
+        return self.patch_json_response(response, etag, last_modified)
+
+    async def adownload_export(self, export_format="csv"):
+        export = self.get_export(export_format, await self.aget_data())
+        return self.get_export_response(export, export.astream())
+
+    async def get(self, request, *args, **kwargs):
+        if hasattr(request, "auser"):
+            # The lazy request.user would load the user synchronously
+            request.user = await request.auser()
+
+        if request.GET.get("export_job") and self.async_export:
+            return await sync_to_async(self.export_job_response)(
+                request.GET["export_job"]
+            )
+        elif request.GET.get("format") == "json":
+            return await self.arender_to_json_response()
+        elif request.GET.get("format") == "events" and self.live_updates:
+            return self.render_event_stream()
+        elif request.GET.get("format") == "choices":
+            return await sync_to_async(self.render_choices_response)()
+        elif request.GET.get("format") in self.get_export_formats():
+            export_format = request.GET["format"]
+            if self.async_export and request.GET.get("export") == "async":
+                return await sync_to_async(self.start_export_job)(export_format)
+            return await self.adownload_export(export_format)
         else:
             context = self.get_context_data()
             return self.render_to_response(context)
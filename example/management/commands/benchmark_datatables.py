@@ -0,0 +1,264 @@
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from datatables.__about__ import __version__
+from example.models import Job, Person
+from example.views import PersonTable
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "David", "Erin", "Frank", "Grace", "Heidi",
+    "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil",
+    "Trent", "Victor", "Walter", "Yvonne",
+]  # fmt: skip
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller",
+    "Davis", "Martinez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore",
+    "Jackson", "Martin", "Lee", "Thompson", "White", "Harris",
+]  # fmt: skip
+EDUCATIONS = [
+    "Preschool", "Middle school", "High school", "Bachelor", "Masters",
+    "Doctorate", None,
+]  # fmt: skip
+JOBS = 50
+PAGE_SIZE = 25
+
+
+class KeysetPersonTable(PersonTable):
+    keyset_pagination = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the example PersonTable on generated SQLite databases of "
+        "Person rows and write the timings as JSON. The default database "
+        "connection is pointed at the generated databases, which are kept in "
+        "--data-dir and reused by later runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            nargs="+",
+            default=[10_000, 100_000, 1_000_000],
+            help="Numbers of Person rows to benchmark with.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Times each case is run, the first run is a warm-up.",
+        )
+        parser.add_argument(
+            "--data-dir",
+            default=os.path.join(tempfile.gettempdir(), "datatables-benchmark"),
+            help="Directory of the generated databases.",
+        )
+        parser.add_argument(
+            "--output",
+            help="File to write the results to instead of stdout.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the generated data."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The benchmark runs on SQLite only.")
+        os.makedirs(options["data_dir"], exist_ok=True)
+        self.repeat = max(options["repeat"], 2)
+        self.factory = RequestFactory()
+
+        results = []
+        for rows in options["rows"]:
+            self.use_database(options["data_dir"], rows, options["seed"])
+            for case, func in self.get_cases(rows):
+                result = {"rows": rows, "case": case, **func()}
+                results.append(result)
+                self.stderr.write(self.format_result(result))
+
+        output = json.dumps(
+            {"meta": self.get_meta(), "results": results}, indent=2, sort_keys=True
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def get_meta(self):
+        return {
+            "datatables": __version__,
+            "django": django.get_version(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": self.repeat,
+            "page_size": PAGE_SIZE,
+            "time": timezone.now().isoformat(),
+        }
+
+    def use_database(self, data_dir, rows, seed):
+        """Point the default connection at a database with rows persons."""
+        path = os.path.join(data_dir, f"persons-{rows}-{seed}.sqlite3")
+        connection.close()
+        connection.settings_dict["NAME"] = path
+        call_command("migrate", "example", verbosity=0)
+        if Person.objects.count() == rows:
+            return
+
+        self.stderr.write(f"Generating {rows} persons in {path}")
+        Person.objects.all().delete()
+        Job.objects.all().delete()
+        self.generate(rows, seed)
+
+    def generate(self, rows, seed, batch_size=10_000):
+        rng = random.Random(seed)
+        jobs = Job.objects.bulk_create(Job(name=f"Job {i}") for i in range(JOBS))
+        born = date(1940, 1, 1)
+        for start in range(0, rows, batch_size):
+            Person.objects.bulk_create(
+                Person(
+                    job=rng.choice(jobs) if rng.random() > 0.1 else None,
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=f"{rng.choice(LAST_NAMES)}{rng.randrange(1000)}",
+                    date_of_birth=born + timedelta(days=rng.randrange(25_000)),
+                    education=rng.choice(EDUCATIONS),
+                )
+                for _ in range(min(batch_size, rows - start))
+            )
+
+    def get_cases(self, rows):
+        columns = [c[0] if isinstance(c, tuple) else c for c in PersonTable.columns]
+        job = Job.objects.order_by("pk").values_list("pk", flat=True).first()
+        middle = rows // 2 // PAGE_SIZE * PAGE_SIZE
+        deep = max(rows - PAGE_SIZE, 0)
+
+        def json_case(view=PersonTable, **params):
+            return lambda: self.time_request(view, {"format": "json", **params})
+
+        return [
+            ("json_first_page", json_case(start=0)),
+            ("json_middle_page", json_case(start=middle)),
+            ("json_deep_page", json_case(start=deep)),
+            ("json_deep_page_keyset", lambda: self.time_keyset_page(deep)),
+            ("search", json_case(**{"search[value]": "alice smith"})),
+            ("filter_related", json_case(**{"filters[]": f"job__id__in={job}"})),
+            (
+                "filter_date",
+                json_case(**{"filters[]": "date_of_birth__gte=1990-01-01 00:00"}),
+            ),
+            ("filter_choices", json_case(**{"filters[]": "education__in=Bachelor"})),
+            (
+                "order_last_name",
+                json_case(**{"order[0][column]": "1", "order[0][dir]": "asc"}),
+            ),
+            (
+                "order_date_of_birth_desc",
+                json_case(**{"order[0][column]": "2", "order[0][dir]": "desc"}),
+            ),
+            ("serialize_data", self.time_serialize_data),
+            ("csv_export", lambda: self.time_export(columns)),
+        ]
+
+    def get_view(self, view_class, params):
+        request = self.factory.get("/", params)
+        view = view_class()
+        view.setup(request)
+        view.init_datatable(request)
+        return view
+
+    def measure(self, func):
+        """Return the timings of calling func, without the warm-up run."""
+        func()
+        wall = []
+        cpu = []
+        for _ in range(self.repeat - 1):
+            started, started_cpu = time.perf_counter(), time.process_time()
+            func()
+            wall.append((time.perf_counter() - started) * 1000)
+            cpu.append((time.process_time() - started_cpu) * 1000)
+        return {
+            "min_ms": round(min(wall), 3),
+            "median_ms": round(statistics.median(wall), 3),
+            "mean_ms": round(statistics.mean(wall), 3),
+            "cpu_median_ms": round(statistics.median(cpu), 3),
+        }
+
+    def time_request(self, view_class, params):
+        params = {"length": PAGE_SIZE, **params}
+
+        def request():
+            view = self.get_view(view_class, params)
+            response = view.get(view.request)
+            if response.status_code != 200:
+                raise CommandError(f"{params} returned {response.status_code}")
+            return response
+
+        result = self.measure(request)
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        result["queries"] = len(queries)
+        result["records_filtered"] = json.loads(response.content)["recordsFiltered"]
+        return result
+
+    def time_keyset_page(self, start):
+        """Time seeking to the page at start from the cursor of the one before."""
+        params = {"format": "json", "length": PAGE_SIZE}
+        previous = max(start - PAGE_SIZE, 0)
+        view = self.get_view(KeysetPersonTable, {**params, "start": previous})
+        cursor = json.loads(view.get(view.request).content)["cursor"]["next"]
+        return self.time_request(
+            KeysetPersonTable, {**params, "start": start, "cursor": cursor}
+        )
+
+    def time_serialize_data(self, count=1000):
+        """Time serialize_data() alone on count rows that are already fetched."""
+        view = self.get_view(PersonTable, {"format": "json"})
+        data = list(view.datatable.get_queryset()[:count])
+        result = self.measure(lambda: view.datatable.serialize_data(data))
+        result["serialized_rows"] = len(data)
+        return result
+
+    def time_export(self, columns):
+        params = {"format": "csv", "visible[]": columns}
+
+        def export():
+            view = self.get_view(PersonTable, params)
+            response = view.get(view.request)
+            return sum(len(chunk) for chunk in response.streaming_content)
+
+        result = self.measure(export)
+        size = export()
+        rows = Person.objects.count()
+        seconds = result["median_ms"] / 1000
+        result["bytes"] = size
+        result["rows_per_second"] = round(rows / seconds) if seconds else None
+        result["bytes_per_second"] = round(size / seconds) if seconds else None
+
+        tracemalloc.start()
+        try:
+            export()
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+
+    def format_result(self, result):
+        return "{rows:>9} {case:<26} {median_ms:>10.1f} ms".format(**result)
@@ -57,9 +57,13 @@ class PersonTable(DatatableView):
         "select": 'multi',
     }
     paginate_by = 1
+    column_fields = {
+        'first_name': ['first_name'],
+        'age': ['date_of_birth'],
+    }
 
     def first_name(self, obj):
-        if self.request.GET.get('format') == 'csv':
+        if self.request.GET.get('format') != 'json':
             return obj.first_name
 
         return format_html(